@@ -1,271 +1,115 @@
 import json
+import os
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
 import pydeck as pdk
-import requests
 import streamlit as st
-from requests.adapters import HTTPAdapter
 from st_aggrid import AgGrid, GridOptionsBuilder
 from st_aggrid.shared import GridUpdateMode
-from urllib3.util.retry import Retry
+
+import ingestao
+import metricas
+from carga_arquivo import EXTENSOES_LEITURA, carregar_arquivo
+from cliente_aneel import (
+    ESTADOS_BR, RES_GD_FOTO, RES_GD_INFO, RES_USINAS, UF_COL_GD_INFO, UF_COL_USINAS,
+    DownloadIncompleto, iterar_base_bruta,
+)
+from cubo_agregado import CuboAgregado
+from exportacao import FORMATOS, exportar_df, exportar_tabelas, formatos_disponiveis
+from grade_servidor import TAMANHO_PAGINA, GradeServidor, total_paginas
+from indice_espacial import IndiceEspacial
+from indice_filtros import IndiceFiltros
+from mapa_agregado import (
+    LIMITE_PONTOS, agregar_celulas, pontos_mapa, tamanho_celula, zoom_para_raio, zoom_para_ufs,
+)
+from normalizacao import bytes_por_linha
 
 st.set_page_config(layout="wide", page_title="Brazil Energy Intelligence")
 st.title("Brazil Energy Intelligence Dashboard - Usinas & GD")
 
-BASE_URL = "https://dadosabertos.aneel.gov.br/api/3/action/datastore_search"
-RES_USINAS  = "11ec447d-698d-4ab8-977f-b424d5deee6a"
-RES_GD_INFO = "b1bd71e7-d0ad-4214-9053-cbd58e9564a7"
-RES_GD_FOTO = "49fa9ca0-f609-4ae3-a6f7-b97bd0945a3a"
-UF_COL_USINAS  = "SigUFPrincipal"
-UF_COL_GD_INFO = "SigUF"
-
-ESTADOS_BR = sorted([
-    "AC","AL","AM","AP","BA","CE","DF","ES","GO",
-    "MA","MG","MS","MT","PA","PB","PE","PI","PR",
-    "RJ","RN","RO","RR","RS","SC","SE","SP","TO"
-])
-
-def make_session():
-    session = requests.Session()
-    retry = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
-
-def fetch_all_pages(resource_id, filters=None, limit_per_page=5000, progress_bar=None):
-    session = make_session()
-    offset = 0
-    total = None
-    all_records = []
-
-    while True:
-        params = {
-            "resource_id": resource_id,
-            "limit": limit_per_page,
-            "offset": offset,
-        }
-        if filters:
-            params["filters"] = json.dumps(filters)
-
-        try:
-            response = session.get(BASE_URL, params=params, timeout=120)
-            data = response.json()
-
-            if not data.get("success", False):
-                break
+# Tempo que o cache em memoria serve um resultado antes de reler o snapshot em disco
+CACHE_MEMORIA_TTL = 900
 
-            result = data["result"]
+MSG_RETOMADA = "As paginas ja recebidas foram salvas; tente de novo para continuar de onde parou."
 
-            if total is None:
-                total = result.get("total", 0)
+# Endpoint HTTP com as metricas em JSON, se ANEEL_METRICAS_PORTA estiver definida
+metricas.iniciar_servidor()
 
-            records = result.get("records", [])
-            if not records:
-                break
+# Download, shards e normalizacao ficam em ingestao.py, que tambem roda sem
+# interface (python -m ingestao) para manter os snapshots atualizados.
+# medir_cache registra acerto/falha de cada funcao em cache.
 
-            all_records.extend(records)
-            offset += limit_per_page
+@metricas.medir_cache("carregar_uf_normalizado", st.cache_data(show_spinner=False, ttl=CACHE_MEMORIA_TTL))
+def carregar_uf_normalizado(uf):
+    return ingestao.carregar_uf_normalizado(uf)
 
-            if progress_bar is not None and total > 0:
-                progress_bar.progress(
-                    min(offset / total, 1.0),
-                    text=str(min(offset, total)) + " / " + str(total) + " registros"
-                )
-
-            if offset >= total:
-                break
-
-            time.sleep(0.05)
-
-        except Exception as e:
-            print("Erro offset=" + str(offset) + ": " + str(e))
-            break
-
-    return pd.DataFrame(all_records)
-
-def fetch_uf(resource_id, uf_column, uf):
-    return fetch_all_pages(resource_id, filters={uf_column: uf})
-
-def baixar_base_bruta(ufs, resource_id, uf_column):
-    todas = set(ufs) >= set(ESTADOS_BR)
-    if todas or uf_column is None:
-        return fetch_all_pages(resource_id)
-
-    max_workers = min(len(ufs), 6)
-    parts = []
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futures = {ex.submit(fetch_uf, resource_id, uf_column, uf): uf for uf in ufs}
-        for fut in as_completed(futures):
-            try:
-                parts.append(fut.result())
-            except Exception as e:
-                print("Erro download UF: " + str(e))
-    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
-
-@st.cache_data(show_spinner=False)
-def carregar_raw(ufs_tuple):
-    ufs = list(ufs_tuple)
-    todas = set(ufs) >= set(ESTADOS_BR)
-
-    if todas:
-        with ThreadPoolExecutor(max_workers=3) as ex:
-            f_us   = ex.submit(fetch_all_pages, RES_USINAS)
-            f_gd   = ex.submit(fetch_all_pages, RES_GD_INFO)
-            f_foto = ex.submit(fetch_all_pages, RES_GD_FOTO)
-        return f_us.result(), f_gd.result(), f_foto.result()
-
-    max_workers = min(len(ufs) * 2 + 1, 8)
-
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        fut_usinas  = {ex.submit(fetch_uf, RES_USINAS,  UF_COL_USINAS,  uf): uf for uf in ufs}
-        fut_gd_info = {ex.submit(fetch_uf, RES_GD_INFO, UF_COL_GD_INFO, uf): uf for uf in ufs}
-        fut_foto    = ex.submit(fetch_all_pages, RES_GD_FOTO)
-
-        parts_usinas = []
-        for fut in as_completed(fut_usinas):
-            try:
-                parts_usinas.append(fut.result())
-            except Exception as e:
-                print("Erro usinas: " + str(e))
-
-        parts_gd = []
-        for fut in as_completed(fut_gd_info):
-            try:
-                parts_gd.append(fut.result())
-            except Exception as e:
-                print("Erro gd_info: " + str(e))
-
-        df_foto = fut_foto.result()
-
-    df_usinas = pd.concat(parts_usinas, ignore_index=True) if parts_usinas else pd.DataFrame()
-    df_gd     = pd.concat(parts_gd,     ignore_index=True) if parts_gd     else pd.DataFrame()
-
-    return df_usinas, df_gd, df_foto
-
-@st.cache_data(show_spinner=False)
+@metricas.medir_cache("carregar_dados_unificados", st.cache_data(show_spinner=False, ttl=CACHE_MEMORIA_TTL))
 def carregar_dados_unificados(ufs_tuple):
-    df_usinas, df_gd, df_gd_tech = carregar_raw(ufs_tuple)
-
-    if not df_usinas.empty:
-        df_usinas["Potencia MW"] = pd.to_numeric(
-            df_usinas.get("MdaPotenciaOutorgadaKw", pd.Series(dtype=str))
-                .astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-            errors="coerce"
-        ) / 1000
-        df_usinas["Lat"] = pd.to_numeric(
-            df_usinas.get("NumCoordNEmpreendimento", pd.Series(dtype=str))
-                .astype(str).str.replace(",", "."), errors="coerce"
-        )
-        df_usinas["Lon"] = pd.to_numeric(
-            df_usinas.get("NumCoordEEmpreendimento", pd.Series(dtype=str))
-                .astype(str).str.replace(",", "."), errors="coerce"
-        )
-        if "DscFaseUsina" in df_usinas.columns:
-            df_usinas = df_usinas[df_usinas["DscFaseUsina"] == "Opera\u00e7\u00e3o"]
-        df_usinas = df_usinas.rename(columns={
-            "CodCEG":               "Codigo",
-            "NomEmpreendimento":    "Nome",
-            "SigUFPrincipal":       "UF",
-            "DscOrigemCombustivel": "Fonte",
-        })
-        df_usinas["Categoria"] = "Usina (Geracao Centralizada)"
-
-    if not df_gd.empty:
-        if not df_gd_tech.empty:
-            df_gd["CodEmpreendimento"] = df_gd["CodEmpreendimento"].astype(str).str.strip()
-            df_gd_tech["CodGeracaoDistribuida"] = df_gd_tech["CodGeracaoDistribuida"].astype(str).str.strip()
-            cols_foto = [c for c in ["CodGeracaoDistribuida", "NomFabricanteModulo", "NomFabricanteInversor"] if c in df_gd_tech.columns]
-            if len(cols_foto) > 1:
-                df_gd = df_gd.merge(
-                    df_gd_tech[cols_foto],
-                    left_on="CodEmpreendimento",
-                    right_on="CodGeracaoDistribuida",
-                    how="left"
-                )
-        df_gd["Potencia MW"] = pd.to_numeric(
-            df_gd.get("MdaPotenciaInstaladaKW", pd.Series(dtype=str))
-                .astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-            errors="coerce"
-        ) / 1000
-        df_gd["Lat"] = pd.to_numeric(
-            df_gd.get("NumCoordNEmpreendimento", pd.Series(dtype=str))
-                .astype(str).str.replace(",", "."), errors="coerce"
-        )
-        df_gd["Lon"] = pd.to_numeric(
-            df_gd.get("NumCoordEEmpreendimento", pd.Series(dtype=str))
-                .astype(str).str.replace(",", "."), errors="coerce"
+    # Sem processos de normalizacao: no Streamlit o __main__ e o app.py, que
+    # cada processo novo (spawn) rodaria de novo. Eles ficam para python -m ingestao.
+    return ingestao.carregar_dados_unificados(ufs_tuple, carregar_uf=carregar_uf_normalizado, processos=1)
+
+@metricas.medir_cache("carregar_mudancas", st.cache_data(show_spinner=False, max_entries=4))
+def carregar_mudancas(ufs_tuple, versao):
+    # A versao muda quando algum snapshot normalizado e regravado
+    return ingestao.mudancas(ufs_tuple)
+
+@metricas.medir_cache("carregar_arquivo_local", st.cache_data(show_spinner=False, max_entries=2))
+def carregar_arquivo_local(_arquivo, file_id, nome):
+    return carregar_arquivo(_arquivo, nome)
+
+@metricas.medir_cache("construir_indice", st.cache_resource(show_spinner=False, max_entries=4))
+def construir_indice(_df, chave_dataset):
+    return IndiceFiltros(_df)
+
+@metricas.medir_cache("construir_cubo", st.cache_resource(show_spinner=False, max_entries=4))
+def construir_cubo(_df, chave_dataset):
+    return CuboAgregado(construir_indice(_df, chave_dataset))
+
+@metricas.medir_cache("construir_indice_espacial", st.cache_resource(show_spinner=False, max_entries=4))
+def construir_indice_espacial(_df, chave_dataset):
+    return IndiceEspacial(_df)
+
+@metricas.medir_cache("construir_grade", st.cache_resource(show_spinner=False, max_entries=4))
+def construir_grade(_df, chave_dataset):
+    return GradeServidor(_df, construir_indice(_df, chave_dataset))
+
+def _tabela_metricas(dados, colunas):
+    if not dados:
+        return
+    tabela = pd.DataFrame.from_dict(dados, orient="index")
+    st.dataframe(tabela.reindex(columns=colunas), use_container_width=True)
+
+def painel_desempenho():
+    r = metricas.resumo()
+    with st.sidebar.expander("Desempenho"):
+        st.caption("Acumulado deste servidor desde o inicio do processo")
+        st.markdown("**Requisicoes a API**")
+        _tabela_metricas(r["requisicoes"], [
+            "requisicoes", "media_ms", "max_s", "espera_s", "parse_s", "bytes",
+            "registros_por_s", "retentativas", "sobrecargas", "erros", "interrupcoes", "paginas_retomadas",
+        ])
+        if r["controle"]:
+            c = r["controle"]
+            st.caption(
+                "Concorrencia: " + str(c["em_uso"]) + " em uso, limite " + str(c["limite_concorrencia"])
+                + " | pausa " + str(c["pausa_restante_s"]) + " s | paginas: "
+                + ", ".join(k + "=" + str(v) for k, v in c["paginas"].items())
+            )
+        st.markdown("**Etapas**")
+        _tabela_metricas(r["etapas"], ["execucoes", "media_ms", "ultimo_s", "max_s", "registros_por_s"])
+        st.markdown("**Caches**")
+        _tabela_metricas(r["caches"], ["acertos", "falhas", "taxa_acerto", "segundos"])
+        st.markdown("**Payloads (bytes)**")
+        _tabela_metricas(r["payloads"], ["ultimo_bytes", "max_bytes"])
+        st.download_button(
+            "Baixar metricas (JSON)",
+            json.dumps(r, ensure_ascii=False, indent=2),
+            "metricas_aneel.json",
+            "application/json"
         )
-        df_gd = df_gd.rename(columns={
-            "CodEmpreendimento":        "Codigo",
-            "NomTitularEmpreendimento": "Nome",
-            "SigUF":                    "UF",
-            "DscFonteGeracao":          "Fonte",
-        })
-        df_gd["Categoria"] = "Geracao Distribuida"
-
-    cols_padrao = ["Codigo", "Nome", "Categoria", "UF", "Fonte", "Potencia MW", "Lat", "Lon"]
-
-    for col in ["NomFabricanteModulo", "NomFabricanteInversor"]:
-        if col not in df_gd.columns:
-            df_gd[col] = "-"
-
-    cols_gd = cols_padrao + ["NomFabricanteModulo", "NomFabricanteInversor"]
-
-    df_final = pd.concat([
-        df_usinas[cols_padrao] if not df_usinas.empty else pd.DataFrame(columns=cols_padrao),
-        df_gd[cols_gd]         if not df_gd.empty    else pd.DataFrame(columns=cols_gd),
-    ], ignore_index=True)
-
-    return df_final.dropna(subset=["Lat", "Lon"]).reset_index(drop=True)
-
-@st.cache_data(show_spinner=False)
-def transformar_csv_carregado(df_raw):
-    cols_padrao = ["Codigo", "Nome", "Categoria", "UF", "Fonte", "Potencia MW", "Lat", "Lon"]
-    if all(c in df_raw.columns for c in cols_padrao):
-        return df_raw.dropna(subset=["Lat", "Lon"]).reset_index(drop=True)
-
-    df = df_raw.copy()
-    e_usina = "CodCEG" in df.columns
-    e_gd    = "CodEmpreendimento" in df.columns and "CodCEG" not in df.columns
-
-    if e_usina:
-        df["Potencia MW"] = pd.to_numeric(
-            df.get("MdaPotenciaOutorgadaKw", pd.Series(dtype=str))
-                .astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-            errors="coerce"
-        ) / 1000
-        df["Lat"] = pd.to_numeric(df.get("NumCoordNEmpreendimento", pd.Series(dtype=str)).astype(str).str.replace(",", "."), errors="coerce")
-        df["Lon"] = pd.to_numeric(df.get("NumCoordEEmpreendimento", pd.Series(dtype=str)).astype(str).str.replace(",", "."), errors="coerce")
-        if "DscFaseUsina" in df.columns:
-            df = df[df["DscFaseUsina"] == "Opera\u00e7\u00e3o"]
-        df = df.rename(columns={"CodCEG": "Codigo", "NomEmpreendimento": "Nome", "SigUFPrincipal": "UF", "DscOrigemCombustivel": "Fonte"})
-        df["Categoria"] = "Usina (Geracao Centralizada)"
-    elif e_gd:
-        df["Potencia MW"] = pd.to_numeric(
-            df.get("MdaPotenciaInstaladaKW", pd.Series(dtype=str))
-                .astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
-            errors="coerce"
-        ) / 1000
-        df["Lat"] = pd.to_numeric(df.get("NumCoordNEmpreendimento", pd.Series(dtype=str)).astype(str).str.replace(",", "."), errors="coerce")
-        df["Lon"] = pd.to_numeric(df.get("NumCoordEEmpreendimento", pd.Series(dtype=str)).astype(str).str.replace(",", "."), errors="coerce")
-        df = df.rename(columns={"CodEmpreendimento": "Codigo", "NomTitularEmpreendimento": "Nome", "SigUF": "UF", "DscFonteGeracao": "Fonte"})
-        df["Categoria"] = "Geracao Distribuida"
-
-    for col in ["NomFabricanteModulo", "NomFabricanteInversor"]:
-        if col not in df.columns:
-            df[col] = "-"
-
-    cols_finais = cols_padrao + ["NomFabricanteModulo", "NomFabricanteInversor"]
-    cols_presentes = [c for c in cols_finais if c in df.columns]
-    return df[cols_presentes].dropna(subset=["Lat", "Lon"]).reset_index(drop=True)
 
 # =====================================================
 # SELECAO DO MODO DE USO
@@ -286,7 +130,7 @@ modo_uso = st.sidebar.radio(
 if modo_uso == "Baixar Base Bruta":
     st.subheader("Download de Base Bruta da ANEEL")
     st.info(
-        "Baixe os dados brutos da API no formato CSV. "
+        "Baixe os dados brutos da API em CSV (opcionalmente compactado) ou Parquet. "
         "Depois use 'Carregar CSV Local' para analisar sem consultar a API novamente."
     )
 
@@ -315,6 +159,8 @@ if modo_uso == "Baixar Base Bruta":
         "GD Foto (Dados Tecnicos)":      (RES_GD_FOTO, None,           "gd_foto"),
     }
 
+    formato_dl = st.selectbox("Formato do arquivo", formatos_disponiveis())
+
     st.caption("Dica: GD Foto nao tem filtro por UF, sera baixado completo independente da selecao.")
 
     if st.button("Iniciar Download", type="primary", use_container_width=True):
@@ -322,34 +168,48 @@ if modo_uso == "Baixar Base Bruta":
 
         st.write("Baixando " + recurso_dl + "...")
 
-        if uf_col is None or set(ufs_dl) >= set(ESTADOS_BR):
-            bar = st.progress(0, text="Iniciando...")
-            df_bruto = fetch_all_pages(resource_id, progress_bar=bar)
-            bar.empty()
-        else:
-            with st.spinner("Baixando " + str(len(ufs_dl)) + " estado(s) em paralelo..."):
-                df_bruto = baixar_base_bruta(ufs_dl, resource_id, uf_col)
+        # As paginas vao direto para o arquivo, sem montar um DataFrame
+        try:
+            if uf_col is None or set(ufs_dl) >= set(ESTADOS_BR):
+                bar = st.progress(0, text="Iniciando...")
+                caminho, linhas, n_colunas = exportar_tabelas(
+                    iterar_base_bruta(ufs_dl, resource_id, uf_col, progress_bar=bar), formato_dl
+                )
+                bar.empty()
+            else:
+                with st.spinner("Baixando " + str(len(ufs_dl)) + " estado(s) em paralelo..."):
+                    caminho, linhas, n_colunas = exportar_tabelas(
+                        iterar_base_bruta(ufs_dl, resource_id, uf_col), formato_dl
+                    )
+        except DownloadIncompleto as e:
+            st.error(str(e) + ". " + MSG_RETOMADA)
+            painel_desempenho()
+            st.stop()
 
-        if df_bruto.empty:
+        if linhas == 0:
+            os.remove(caminho)
             st.error("Nenhum dado retornado. Verifique a conexao e tente novamente.")
         else:
-            st.success(str(len(df_bruto)) + " registros baixados!")
+            st.success(str(linhas) + " registros baixados!")
+            extensao, mime, _ = FORMATOS[formato_dl]
             ufs_str = "todos" if selecionar_todos_dl else "-".join(sorted(ufs_dl))
-            nome_csv = nome_arquivo + "_" + ufs_str + ".csv"
-            csv_bytes = df_bruto.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Clique aqui para salvar o CSV",
-                data=csv_bytes,
-                file_name=nome_csv,
-                mime="text/csv",
-                use_container_width=True
-            )
+            nome_saida = nome_arquivo + "_" + ufs_str + extensao
+            with open(caminho, "rb") as f:
+                st.download_button(
+                    label="Clique aqui para salvar o arquivo",
+                    data=f,
+                    file_name=nome_saida,
+                    mime=mime,
+                    use_container_width=True
+                )
             st.caption(
-                nome_csv + " | " +
-                str(len(df_bruto.columns)) + " colunas | " +
-                str(len(df_bruto)) + " linhas"
+                nome_saida + " | " +
+                str(n_colunas) + " colunas | " +
+                str(linhas) + " linhas"
             )
+            os.remove(caminho)
 
+    painel_desempenho()
     st.stop()
 
 # =====================================================
@@ -359,11 +219,11 @@ if modo_uso == "Baixar Base Bruta":
 elif modo_uso == "Carregar CSV Local":
     st.subheader("Carregar CSV para Analise")
     st.info(
-        "Faca o upload de um CSV baixado anteriormente. "
+        "Faca o upload de um CSV (ou .csv.gz, .csv.zst, .parquet) baixado anteriormente. "
         "O sistema detecta automaticamente se e um CSV bruto ou ja processado."
     )
 
-    arquivo = st.file_uploader("Selecione o arquivo CSV", type=["csv"])
+    arquivo = st.file_uploader("Selecione o arquivo", type=EXTENSOES_LEITURA)
 
     if arquivo is None:
         st.warning("Nenhum arquivo carregado. Faca o upload de um CSV para continuar.")
@@ -371,8 +231,7 @@ elif modo_uso == "Carregar CSV Local":
 
     with st.spinner("Processando arquivo..."):
         try:
-            df_raw = pd.read_csv(arquivo, low_memory=False)
-            df = transformar_csv_carregado(df_raw)
+            df = carregar_arquivo_local(arquivo, arquivo.file_id, arquivo.name)
         except Exception as e:
             st.error("Erro ao ler o arquivo: " + str(e))
             st.stop()
@@ -382,7 +241,9 @@ elif modo_uso == "Carregar CSV Local":
         st.stop()
 
     st.success(str(len(df)) + " registros carregados do arquivo.")
+    st.caption("Memoria: " + str(round(bytes_por_linha(df))) + " bytes por linha")
     ufs_escolhidas_para_zoom = df["UF"].dropna().unique().tolist()
+    chave_dataset = ("arquivo", arquivo.file_id, arquivo.name, arquivo.size)
 
 # =====================================================
 # MODO 3: CONSULTAR API
@@ -411,8 +272,19 @@ else:
 
     chave_cache = tuple(sorted(ufs_escolhidas))
 
+    if carregar and st.session_state.get("chave_atual") == chave_cache:
+        # Dados ja abertos: baixa de novo os shards e aplica aos snapshots
+        # normalizados so as diferencas (ver ingestao.renormalizar_uf)
+        with st.spinner("Atualizando dados..."):
+            falhas = ingestao.ingerir(list(chave_cache), {"usinas", "gd_info"}, forcar=True, processos=1)
+        carregar_uf_normalizado.clear()
+        carregar_dados_unificados.clear()
+        if falhas:
+            st.sidebar.warning("Nao foi possivel atualizar: " + ", ".join(falhas))
+
     if "chave_atual" not in st.session_state or st.session_state["chave_atual"] != chave_cache:
-        if not carregar:
+        # Com os snapshots ja gerados (ex.: pelo cron de ingestao) abre direto
+        if not carregar and not ingestao.snapshots_prontos(chave_cache):
             if len(ufs_escolhidas) <= 5:
                 estados_str = ", ".join(ufs_escolhidas)
             else:
@@ -428,14 +300,52 @@ else:
         modo_label = str(len(ufs_escolhidas)) + " estados"
 
     with st.spinner("Buscando dados para " + modo_label + "..."):
-        df = carregar_dados_unificados(chave_cache)
+        try:
+            df = carregar_dados_unificados(chave_cache)
+        except DownloadIncompleto as e:
+            st.error(str(e) + ". " + MSG_RETOMADA)
+            painel_desempenho()
+            st.stop()
 
     if df.empty:
         st.error("Nenhum dado retornado. Tente novamente ou selecione outros estados.")
         st.stop()
 
     st.sidebar.success(str(len(df)) + " instalacoes carregadas.")
+    st.sidebar.caption("Memoria: " + str(round(bytes_por_linha(df))) + " bytes por linha")
     ufs_escolhidas_para_zoom = ufs_escolhidas
+    chave_dataset = ("api", chave_cache, df.attrs.get("versao"))
+
+    feed, contagem_mudancas = carregar_mudancas(chave_cache, df.attrs.get("versao"))
+    if not feed.empty:
+        with st.expander("O que mudou desde a ultima atualizacao"):
+            col_a, col_b, col_c = st.columns(3)
+            col_a.metric("Adicionadas", str(contagem_mudancas["adicionado"]))
+            col_b.metric("Alteradas",   str(contagem_mudancas["alterado"]))
+            col_c.metric("Removidas",   str(contagem_mudancas["removido"]))
+            # Uma pagina por vez, como na grade; o feed inteiro so vai no arquivo exportado
+            n_paginas_mudancas = total_paginas(len(feed))
+            pagina_mudancas = st.number_input(
+                "Pagina", min_value=1, max_value=n_paginas_mudancas, value=1, step=1, key="pagina_mudancas"
+            )
+            ini = (int(pagina_mudancas) - 1) * TAMANHO_PAGINA
+            st.dataframe(feed.iloc[ini:ini + TAMANHO_PAGINA], use_container_width=True, hide_index=True)
+            st.caption(
+                "Linhas " + str(ini + 1) + " a " + str(min(ini + TAMANHO_PAGINA, len(feed))) + " de " +
+                str(len(feed)) + " | Pagina " + str(int(pagina_mudancas)) + " de " + str(n_paginas_mudancas)
+            )
+            col_fmt_m, col_btn_m = st.columns([1, 2])
+            with col_fmt_m:
+                formato_mudancas = st.selectbox(
+                    "Formato", formatos_disponiveis(), key="formato_mudancas", label_visibility="collapsed"
+                )
+            with col_btn_m:
+                if st.button("Gerar arquivo com as mudancas"):
+                    caminho, _, _ = exportar_df(feed, formato_mudancas)
+                    extensao, mime, _ = FORMATOS[formato_mudancas]
+                    with open(caminho, "rb") as f:
+                        st.download_button("Baixar Mudancas", f, "mudancas_aneel" + extensao, mime)
+                    os.remove(caminho)
 
 # =====================================================
 # DASHBOARD - COMUM PARA MODOS 2 E 3
@@ -444,55 +354,131 @@ else:
 st.sidebar.markdown("---")
 st.sidebar.header("Filtros")
 
+indice = construir_indice(df, chave_dataset)
+cubo = construir_cubo(df, chave_dataset)
+
 categorias = st.sidebar.multiselect(
     "Categoria",
-    sorted(df["Categoria"].dropna().unique()),
-    default=sorted(df["Categoria"].dropna().unique())
+    indice.valores("Categoria"),
+    default=indice.valores("Categoria")
 )
-fontes = st.sidebar.multiselect("Fonte de Energia", sorted(df["Fonte"].dropna().unique()))
+fontes = st.sidebar.multiselect("Fonte de Energia", indice.valores("Fonte"))
+ufs_filtro = []
+if len(indice.valores("UF")) > 1:
+    ufs_filtro = st.sidebar.multiselect("Estado (UF)", indice.valores("UF"))
 
-pot_max_val = float(df["Potencia MW"].max()) if df["Potencia MW"].max() > 0 else 1.0
+pot_max_dados = np.nanmax(indice.potencia) if len(df) else 0.0
+pot_max_val = float(pot_max_dados) if pot_max_dados > 0 else 1.0
 pot_min, pot_max = st.sidebar.slider("Capacidade (MW)", 0.0, pot_max_val, (0.0, pot_max_val))
 
-df_filtrado = df.copy()
-if categorias:
-    df_filtrado = df_filtrado[df_filtrado["Categoria"].isin(categorias)]
-if fontes:
-    df_filtrado = df_filtrado[df_filtrado["Fonte"].isin(fontes)]
-df_filtrado = df_filtrado[
-    (df_filtrado["Potencia MW"] >= pot_min) &
-    (df_filtrado["Potencia MW"] <= pot_max)
-]
+# Filtro de proximidade: raio em km ou as N instalacoes mais proximas de um
+# ponto, informado por coordenadas ou pelo codigo de uma instalacao
+modo_proximidade = st.sidebar.selectbox("Proximidade", ["Sem filtro", "Raio (km)", "Mais proximas"])
+centro = None
+if modo_proximidade != "Sem filtro" and len(df):
+    codigo_centro = ""
+    if "Codigo" in df.columns:
+        codigo_centro = st.sidebar.text_input("Centro: Codigo da instalacao (opcional)").strip()
+    col_lat, col_lon = st.sidebar.columns(2)
+    lat_centro = col_lat.number_input("Latitude", -90.0, 90.0, round(float(df["Lat"].mean()), 4), format="%.4f")
+    lon_centro = col_lon.number_input("Longitude", -180.0, 180.0, round(float(df["Lon"].mean()), 4), format="%.4f")
+    espacial = construir_indice_espacial(df, chave_dataset)
+    if codigo_centro:
+        encontrado = espacial.posicao(codigo_centro)
+        if encontrado is not None:
+            lat_centro = float(df["Lat"].iat[encontrado])
+            lon_centro = float(df["Lon"].iat[encontrado])
+        else:
+            st.sidebar.warning("Codigo nao encontrado; usando as coordenadas.")
+    if modo_proximidade == "Raio (km)":
+        raio_km = st.sidebar.number_input("Raio (km)", 1.0, 3000.0, 50.0, step=10.0)
+    else:
+        n_proximas = int(st.sidebar.number_input("Quantidade", 1, 100000, 10, step=10))
+    centro = (lat_centro, lon_centro)
+
+with metricas.cronometro("filtro") as info:
+    posicoes = indice.selecionar(categorias, fontes, ufs_filtro, pot_min, pot_max)
+    info["registros"] = len(df)
+
+if centro is not None:
+    with metricas.cronometro("filtro_proximidade") as info:
+        permitidas = np.zeros(len(df), dtype=bool)
+        permitidas[posicoes] = True
+        if modo_proximidade == "Raio (km)":
+            posicoes, _ = espacial.raio(centro[0], centro[1], raio_km, permitidas)
+        else:
+            posicoes, distancias = espacial.proximas(centro[0], centro[1], n_proximas, permitidas)
+            raio_km = float(distancias.max()) if len(distancias) else 0.0
+            posicoes = np.sort(posicoes)
+        info["registros"] = len(posicoes)
+
+# Metricas e distribuicao saem do cubo; so faixas de potencia cortadas pelo
+# slider sao somadas a partir das linhas filtradas. O cubo nao tem a
+# dimensao espacial, entao com proximidade as linhas sao somadas direto.
+with metricas.cronometro("cubo") as info:
+    if centro is not None:
+        contagem_cubo, potencia_cubo = cubo.agregar(posicoes)
+        info["registros"] = len(posicoes)
+    else:
+        contagem_cubo, potencia_cubo, faixa_cortada = cubo.consultar(
+            categorias, fontes, ufs_filtro, pot_min, pot_max, posicoes=posicoes
+        )
+        info["registros"] = len(posicoes) if faixa_cortada else 0
+    resumo = cubo.resumo(contagem_cubo, potencia_cubo)
 
 col1, col2, col3, col4 = st.columns(4)
-col1.metric("Total de Instalacoes",  str(len(df_filtrado)))
-col2.metric("Capacidade Total (MW)", str(round(df_filtrado["Potencia MW"].sum(), 2)))
-col3.metric("Estados",               str(df_filtrado["UF"].nunique()))
-col4.metric("Fontes distintas",      str(df_filtrado["Fonte"].nunique()))
+col1.metric("Total de Instalacoes",  str(resumo["instalacoes"]))
+col2.metric("Capacidade Total (MW)", str(round(resumo["potencia_mw"], 2)))
+col3.metric("Estados",               str(resumo["ufs"]))
+col4.metric("Fontes distintas",      str(resumo["fontes"]))
+
+with st.expander("Distribuicao da Capacidade"):
+    tabela_cubo = cubo.tabela(contagem_cubo, potencia_cubo)
+    aba_uf, aba_fonte, aba_tabela = st.tabs(["Por UF", "Por Fonte", "Tabela"])
+    with aba_uf:
+        st.bar_chart(tabela_cubo.pivot_table(
+            index="UF", columns="Fonte", values="Potencia MW", aggfunc="sum", fill_value=0, observed=True
+        ), y_label="MW")
+    with aba_fonte:
+        st.bar_chart(tabela_cubo.pivot_table(
+            index="Fonte", columns="Categoria", values="Potencia MW", aggfunc="sum", fill_value=0, observed=True
+        ), y_label="MW")
+    with aba_tabela:
+        st.dataframe(
+            tabela_cubo.sort_values("Potencia MW", ascending=False),
+            use_container_width=True, hide_index=True
+        )
 
 st.markdown("---")
 st.subheader("Visao Geoespacial")
 
-map_data = df_filtrado.copy()
-center_lat = map_data["Lat"].mean() if not map_data.empty else -14.2350
-center_lon = map_data["Lon"].mean() if not map_data.empty else -51.9253
-
-if len(ufs_escolhidas_para_zoom) == 1:
-    zoom_level = 6
-elif len(ufs_escolhidas_para_zoom) <= 5:
-    zoom_level = 5
-else:
-    zoom_level = 4
-
-map_data["map_radius"] = map_data["Potencia MW"].apply(lambda x: max(x * 500, 2000))
-
-if len(map_data) > 3000:
+inicio_mapa = time.perf_counter()
+zoom_level = zoom_para_ufs(ufs_escolhidas_para_zoom)
+lat_sel = df["Lat"].to_numpy()[posicoes]
+lon_sel = df["Lon"].to_numpy()[posicoes]
+center_lat = float(lat_sel.mean()) if len(posicoes) else -14.2350
+center_lon = float(lon_sel.mean()) if len(posicoes) else -51.9253
+if centro is not None:
+    zoom_level = zoom_para_raio(raio_km)
+    center_lat, center_lon = centro
+
+if len(posicoes) > LIMITE_PONTOS:
+    tamanho = tamanho_celula(zoom_level)
+    map_data = agregar_celulas(
+        lat_sel, lon_sel, indice.potencia[posicoes],
+        indice.codigos["Fonte"][posicoes], indice.categorias["Fonte"], tamanho
+    )
     layer = pdk.Layer(
-        "HexagonLayer", data=map_data, get_position="[Lon, Lat]",
-        radius=30000, elevation_scale=50, pickable=True, extruded=True,
+        "ColumnLayer", data=map_data, get_position="[Lon, Lat]",
+        get_elevation="Instalacoes", elevation_scale=50, radius=tamanho * 111000 / 2,
+        get_fill_color=[0, 110, 255, 180], pickable=True, extruded=True,
     )
-    tooltip_html = {"html": "<b>Agrupamento</b><br/>Instalacoes na area: <b>{elevationValue}</b>"}
+    tooltip_html = {
+        "html": "<b>Agrupamento</b><br/>Instalacoes na area: <b>{Instalacoes}</b><br/>"
+                "Capacidade: {Potencia MW} MW<br/>Fonte predominante: {Fonte}"
+    }
 else:
+    map_data = pontos_mapa(df, posicoes)
     layer = pdk.Layer(
         "ScatterplotLayer", data=map_data, get_position="[Lon, Lat]",
         get_radius="map_radius", get_fill_color=[0, 110, 255, 180], pickable=True,
@@ -502,40 +488,82 @@ else:
                 "Capacidade: {Potencia MW} MW<br/>Estado: {UF}<br/>Fonte: {Fonte}"
     }
 
-st.pydeck_chart(pdk.Deck(
-    layers=[layer],
+camadas = [layer]
+if centro is not None:
+    # Ponto de referencia e o raio coberto pela busca
+    camadas.append(pdk.Layer(
+        "ScatterplotLayer", data=pd.DataFrame({"Lat": [centro[0]], "Lon": [centro[1]]}),
+        get_position="[Lon, Lat]", get_radius=max(raio_km, 0.5) * 1000, filled=False, stroked=True,
+        get_line_color=[220, 40, 40, 200], line_width_min_pixels=2,
+    ))
+
+deck = pdk.Deck(
+    layers=camadas,
     initial_view_state=pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=zoom_level),
     map_style=pdk.map_styles.LIGHT,
     tooltip=tooltip_html
-))
+)
+metricas.registrar_etapa("preparar_mapa", time.perf_counter() - inicio_mapa, len(posicoes))
+metricas.registrar_tamanho("mapa", len(deck.to_json()))
+st.pydeck_chart(deck)
 
 st.markdown("---")
 st.subheader("Base de Dados Completa")
 
-df_exibicao = (
-    df_filtrado
-    .drop(columns=["map_radius"], errors="ignore")
-    .sort_values("Potencia MW", ascending=False)
-)
+grade = construir_grade(df, chave_dataset)
 
-gb = GridOptionsBuilder.from_dataframe(df_exibicao)
-gb.configure_default_column(filter=True, sortable=True, resizable=True, floatingFilter=True)
-gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=50)
+col_ord, col_dir, col_busca, col_pag = st.columns([2, 1, 2, 1])
+with col_ord:
+    coluna_ordem = st.selectbox("Ordenar por", list(df.columns), index=list(df.columns).index("Potencia MW"))
+with col_dir:
+    decrescente = st.checkbox("Decrescente", value=True)
+with col_busca:
+    texto_busca = st.text_input("Buscar (Nome ou Codigo)")
+
+inicio_grade = time.perf_counter()
+posicoes_grade = grade.ordenar(grade.buscar(posicoes, texto_busca), coluna_ordem, not decrescente)
+n_paginas = total_paginas(len(posicoes_grade))
+with col_pag:
+    pagina = st.number_input("Pagina", min_value=1, max_value=n_paginas, value=1, step=1)
+
+df_pagina = grade.pagina(posicoes_grade, int(pagina))
+metricas.registrar_etapa("preparar_grade", time.perf_counter() - inicio_grade, len(posicoes))
+metricas.registrar_tamanho("grade", len(df_pagina.to_json(orient="records")))
+
+gb = GridOptionsBuilder.from_dataframe(df_pagina)
+gb.configure_default_column(resizable=True)
 gb.configure_selection("single", use_checkbox=True)
 
 AgGrid(
-    df_exibicao,
+    df_pagina,
     gridOptions=gb.build(),
     update_mode=GridUpdateMode.NO_UPDATE,
     theme="streamlit",
     height=500
 )
-
-csv = df_exibicao.to_csv(index=False).encode("utf-8")
-st.download_button(
-    "Baixar Dados Filtrados (CSV)",
-    csv,
-    "dados_energia_brasil.csv",
-    "text/csv"
+st.caption(
+    "Linhas " + str(min((int(pagina) - 1) * TAMANHO_PAGINA + 1, len(posicoes_grade))) + " a " +
+    str(min(int(pagina) * TAMANHO_PAGINA, len(posicoes_grade))) + " de " + str(len(posicoes_grade)) +
+    " | Pagina " + str(int(pagina)) + " de " + str(n_paginas)
 )
 
+col_fmt, col_btn = st.columns([1, 2])
+with col_fmt:
+    formato_filtrado = st.selectbox("Formato", formatos_disponiveis(), label_visibility="collapsed")
+with col_btn:
+    gerar_arquivo = st.button("Gerar arquivo com os dados filtrados")
+
+if gerar_arquivo:
+    with st.spinner("Gerando arquivo..."):
+        caminho, _, _ = exportar_df(df, formato_filtrado, posicoes_grade)
+    extensao, mime, _ = FORMATOS[formato_filtrado]
+    with open(caminho, "rb") as f:
+        st.download_button(
+            "Baixar Dados Filtrados",
+            f,
+            "dados_energia_brasil" + extensao,
+            mime
+        )
+    os.remove(caminho)
+
+painel_desempenho()
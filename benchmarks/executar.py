@@ -0,0 +1,332 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import cliente_aneel
+import ingestao
+import snapshot
+from carga_arquivo import carregar_arquivo
+from cliente_aneel import ESTADOS_BR, PROJECOES, RES_GD_INFO, RES_USINAS, UF_COLUNAS
+from exportacao import exportar_tabelas
+from grade_servidor import GradeServidor
+from cubo_agregado import CuboAgregado
+from indice_espacial import IndiceEspacial
+from indice_filtros import IndiceFiltros
+from mapa_agregado import LIMITE_PONTOS, agregar_celulas, pontos_mapa, tamanho_celula, zoom_para_ufs
+from normalizacao import bytes_por_linha, normalizar_arquivo
+
+# Mede cada etapa do pipeline contra o stub local (benchmarks/stub_ckan.py):
+# tempo, linhas por segundo e pico de memoria (RSS do processo e memoria
+# alocada pelo Arrow). O resultado sai em JSON para comparar execucoes.
+#
+#   python -m benchmarks.executar --gd 1000000 --saida base.json
+#   python -m benchmarks.executar --gd 1000000 --comparar base.json
+
+INTERVALO_AMOSTRA = 0.01
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Amostrador(threading.Thread):
+    # Acompanha o pico de memoria enquanto a etapa roda
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.parar_evento = threading.Event()
+        self.rss_inicio = _rss()
+        self.arrow_inicio = pa.total_allocated_bytes()
+        self.rss_pico = self.rss_inicio
+        self.arrow_pico = self.arrow_inicio
+
+    def amostrar(self):
+        self.rss_pico = max(self.rss_pico, _rss())
+        self.arrow_pico = max(self.arrow_pico, pa.total_allocated_bytes())
+
+    def run(self):
+        while not self.parar_evento.wait(INTERVALO_AMOSTRA):
+            self.amostrar()
+
+    def parar(self):
+        self.parar_evento.set()
+        self.join()
+        self.amostrar()
+
+def _mb(n):
+    return round(n / (1 << 20), 1)
+
+def medir(resultados, etapa, func, repeticoes=1):
+    # func devolve (saida, linhas processadas)
+    gc.collect()
+    amostrador = Amostrador()
+    amostrador.start()
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        saida, linhas = func()
+    segundos = (time.perf_counter() - inicio) / repeticoes
+    amostrador.parar()
+
+    resultado = {
+        "etapa":          etapa,
+        "segundos":       round(segundos, 4),
+        "linhas":         int(linhas),
+        "linhas_por_s":   round(linhas / segundos) if segundos > 0 else None,
+        "repeticoes":     repeticoes,
+        "rss_pico_mb":    _mb(amostrador.rss_pico),
+        "rss_delta_mb":   _mb(amostrador.rss_pico - amostrador.rss_inicio),
+        "arrow_delta_mb": _mb(amostrador.arrow_pico - amostrador.arrow_inicio),
+    }
+    resultados.append(resultado)
+    print(etapa + ": " + str(resultado["segundos"]) + " s, " + str(resultado["linhas"]) + " linhas, pico +" +
+          str(resultado["rss_delta_mb"]) + " MB", file=sys.stderr)
+    return saida
+
+# =====================================================
+# STUB
+# =====================================================
+
+def iniciar_stub(args):
+    comando = [
+        sys.executable, "-m", "benchmarks.stub_ckan", "--porta", "0",
+        "--usinas", str(args.usinas), "--gd", str(args.gd), "--foto", str(args.foto),
+        "--latencia", str(args.latencia), "--taxa-erro", str(args.taxa_erro),
+    ]
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processo = subprocess.Popen(comando, cwd=raiz, stdout=subprocess.PIPE, text=True)
+    url = processo.stdout.readline().strip()
+    if not url:
+        processo.kill()
+        raise RuntimeError("Stub nao iniciou")
+    return processo, url
+
+def estatisticas_stub(url):
+    try:
+        return cliente_aneel.get_session().get(url.rsplit("/", 1)[0] + "/_stats", timeout=10).json()
+    except Exception as e:
+        print("Erro lendo estatisticas do stub: " + str(e), file=sys.stderr)
+        return None
+
+# =====================================================
+# ETAPAS
+# =====================================================
+
+def _com_linhas(df):
+    return df, len(df)
+
+def etapa_download(resultados, ufs, diretorio):
+    for res in (RES_USINAS, RES_GD_INFO):
+        fields, filters = PROJECOES[res]
+        medir(resultados, "download_" + cliente_aneel.NOMES_RECURSOS[res], lambda res=res, fields=fields, filters=filters: _com_linhas(
+            cliente_aneel.baixar_base_bruta(ufs, res, UF_COLUNAS[res], fields=fields, filters=filters)
+        ))
+
+    # Base bruta completa direto para CSV, como no modo Baixar Base Bruta
+    def base_bruta():
+        caminho, linhas, _ = exportar_tabelas(
+            cliente_aneel.iterar_base_bruta(ufs, RES_GD_INFO, UF_COLUNAS[RES_GD_INFO]), "CSV"
+        )
+        destino = os.path.join(diretorio, "gd_info_bruto.csv")
+        shutil.move(caminho, destino)
+        return destino, linhas
+    return medir(resultados, "download_base_bruta_csv", base_bruta)
+
+def etapa_carregar_dados_unificados(resultados, ufs):
+    ufs_tuple = tuple(sorted(ufs))
+    # Primeira chamada baixa e normaliza; a segunda so le os snapshots
+    medir(resultados, "carregar_dados_unificados_frio", lambda: _com_linhas(ingestao.carregar_dados_unificados(ufs_tuple)))
+    return medir(resultados, "carregar_dados_unificados_snapshot", lambda: _com_linhas(ingestao.carregar_dados_unificados(ufs_tuple)))
+
+def _apagar_normalizados(ufs):
+    # Sem snapshot normalizado nem hashes, a proxima normalizacao e completa
+    for uf in ufs:
+        for chave in (ingestao.chave_normalizado(uf), ingestao.chave_hashes(uf)):
+            for caminho in glob.glob(os.path.join(snapshot.CACHE_DIR, chave + ".*")):
+                os.remove(caminho)
+
+def etapa_normalizacao(resultados, ufs, processos):
+    # Normalizacao completa de todas as UFs, serial e com processos
+    def serial():
+        _apagar_normalizados(ufs)
+        return None, sum(len(ingestao.renormalizar_uf(uf)) for uf in ufs)
+
+    def paralela():
+        _apagar_normalizados(ufs)
+        prontos = ingestao.normalizar_ufs(ufs, processos, min_registros=0)
+        return None, sum(len(df) for df in prontos.values())
+
+    medir(resultados, "normalizar_serial", serial)
+    medir(resultados, "normalizar_processos", paralela)
+    resultados[-1]["processos"] = min(processos or ingestao.PROCESSOS_NORMALIZACAO, len(ufs))
+
+def etapa_arquivo(resultados, caminho_csv):
+    # DataFrame bruto todo em texto, como o antigo upload via pd.read_csv
+    df_raw = pd.read_csv(caminho_csv, dtype=str)
+    medir(resultados, "transformar_csv_carregado", lambda: (None, len(normalizar_arquivo(df_raw))))
+    df_raw = None
+    medir(resultados, "carregar_arquivo_csv", lambda: (None, len(carregar_arquivo(caminho_csv, caminho_csv))))
+
+def etapa_filtro(resultados, df, repeticoes):
+    indice = medir(resultados, "construir_indice", lambda: (IndiceFiltros(df), len(df)))
+    fontes = indice.valores("Fonte")
+    ufs = indice.valores("UF")
+    pot_max = float(np.nanmax(indice.potencia)) if len(df) else 1.0
+    cenarios = {
+        "filtro_sem_restricao":  (indice.valores("Categoria"), [], [], 0.0, pot_max),
+        "filtro_fonte":          (indice.valores("Categoria"), fontes[:1], [], 0.0, pot_max),
+        "filtro_uf_potencia":    (indice.valores("Categoria"), [], ufs[:2], 0.0, pot_max / 100),
+        "filtro_combinado":      (indice.valores("Categoria")[:1], fontes[:2], ufs[:3], 0.001, pot_max / 10),
+    }
+    posicoes = None
+    por_cenario = {}
+    for nome, args in cenarios.items():
+        pos = medir(resultados, nome, lambda args=args: _com_linhas(indice.selecionar(*args)), repeticoes)
+        por_cenario[nome] = pos
+        if posicoes is None:
+            posicoes = pos
+
+    # Metricas do painel a partir do cubo, com as posicoes ja filtradas
+    cubo = medir(resultados, "construir_cubo", lambda: (CuboAgregado(indice), len(df)))
+    for nome, args in cenarios.items():
+        def resumo_cubo(args=args, pos=por_cenario[nome]):
+            contagem, potencia, _ = cubo.consultar(*args, posicoes=pos)
+            return cubo.resumo(contagem, potencia), len(pos)
+        medir(resultados, "cubo_" + nome[len("filtro_"):], resumo_cubo, repeticoes)
+
+    # Proximidade em torno de uma instalacao da base
+    espacial = medir(resultados, "construir_indice_espacial", lambda: (IndiceEspacial(df), len(df)))
+    if len(df):
+        lat, lon = float(df["Lat"].iat[0]), float(df["Lon"].iat[0])
+        medir(resultados, "proximidade_raio_50km", lambda: (None, len(espacial.raio(lat, lon, 50.0)[0])), repeticoes)
+        medir(resultados, "proximidade_100_mais", lambda: (None, len(espacial.proximas(lat, lon, 100)[0])), repeticoes)
+    return indice, posicoes
+
+def etapa_render(resultados, df, indice, posicoes, ufs, repeticoes):
+    zoom = zoom_para_ufs(ufs)
+
+    def mapa():
+        if len(posicoes) > LIMITE_PONTOS:
+            dados = agregar_celulas(
+                df["Lat"].to_numpy()[posicoes], df["Lon"].to_numpy()[posicoes], indice.potencia[posicoes],
+                indice.codigos["Fonte"][posicoes], indice.categorias["Fonte"], tamanho_celula(zoom)
+            )
+        else:
+            dados = pontos_mapa(df, posicoes)
+        return dados, len(posicoes)
+    dados_mapa = medir(resultados, "render_mapa", mapa, repeticoes)
+    resultados[-1]["linhas_saida"] = len(dados_mapa)
+
+    grade = medir(resultados, "construir_grade", lambda: (GradeServidor(df, indice), len(df)))
+
+    def pagina_grade():
+        ordenadas = grade.ordenar(grade.buscar(posicoes, "1"), "Potencia MW", False)
+        return grade.pagina(ordenadas, 1), len(posicoes)
+    medir(resultados, "render_grade", pagina_grade, repeticoes)
+
+# =====================================================
+# EXECUCAO
+# =====================================================
+
+def comparar(atual, caminho_base):
+    with open(caminho_base, encoding="utf-8") as f:
+        base = {e["etapa"]: e for e in json.load(f)["etapas"]}
+    print("etapa;segundos_base;segundos;razao;rss_delta_base_mb;rss_delta_mb", file=sys.stderr)
+    for e in atual["etapas"]:
+        b = base.get(e["etapa"])
+        if b is None:
+            continue
+        razao = round(e["segundos"] / b["segundos"], 2) if b["segundos"] else None
+        print(";".join(str(v) for v in [
+            e["etapa"], b["segundos"], e["segundos"], razao, b["rss_delta_mb"], e["rss_delta_mb"]
+        ]), file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.executar", description="Benchmark do pipeline ANEEL contra um stub local.")
+    parser.add_argument("--usinas", type=int, default=30000, help="linhas sinteticas de Usinas")
+    parser.add_argument("--gd", type=int, default=200000, help="linhas sinteticas de GD Info")
+    parser.add_argument("--foto", type=int, default=200000, help="linhas sinteticas de GD Foto")
+    parser.add_argument("--ufs", nargs="+", default=ESTADOS_BR, metavar="UF")
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por requisicao no stub")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fracao de respostas 429/5xx no stub")
+    parser.add_argument("--repeticoes", type=int, default=5, help="repeticoes das etapas rapidas (filtro e render)")
+    parser.add_argument("--processos", type=int, default=None, help="processos da etapa normalizar_processos")
+    parser.add_argument("--url", help="usa um stub ja em execucao em vez de iniciar um")
+    parser.add_argument("--saida", help="arquivo JSON de saida (padrao: stdout)")
+    parser.add_argument("--comparar", metavar="JSON", help="resultado anterior para comparar")
+    args = parser.parse_args(argv)
+
+    processo = None
+    if args.url:
+        url = args.url
+    else:
+        processo, url = iniciar_stub(args)
+    diretorio = tempfile.mkdtemp(prefix="bench_aneel_")
+    cliente_aneel.BASE_URL = url
+    snapshot.CACHE_DIR = os.path.join(diretorio, "cache")
+
+    ufs = sorted(set(u.upper() for u in args.ufs))
+    resultados = []
+    inicio = time.time()
+    try:
+        caminho_csv = etapa_download(resultados, ufs, diretorio)
+        df = etapa_carregar_dados_unificados(resultados, ufs)
+        etapa_normalizacao(resultados, ufs, args.processos)
+        etapa_arquivo(resultados, caminho_csv)
+        indice, posicoes = etapa_filtro(resultados, df, args.repeticoes)
+        etapa_render(resultados, df, indice, posicoes, ufs, args.repeticoes)
+        stub = estatisticas_stub(url)
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    saida = {
+        "gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "duracao_s": round(time.time() - inicio, 2),
+        "config": {
+            "usinas": args.usinas, "gd": args.gd, "foto": args.foto, "ufs": len(ufs),
+            "latencia": args.latencia, "taxa_erro": args.taxa_erro, "repeticoes": args.repeticoes,
+            "max_requisicoes": cliente_aneel.MAX_REQUISICOES,
+            "max_concorrencia_paginas": cliente_aneel.MAX_CONCORRENCIA_PAGINAS,
+            "tamanho_pagina_inicial": cliente_aneel.TAMANHO_PAGINA_INICIAL,
+        },
+        "controle_vazao": cliente_aneel.controle.estado(),
+        "ambiente": {
+            "python": platform.python_version(), "pandas": pd.__version__,
+            "numpy": np.__version__, "pyarrow": pa.__version__, "cpus": os.cpu_count(),
+        },
+        "linhas_dataset": len(df),
+        "bytes_por_linha": round(bytes_por_linha(df), 1),
+        "stub": stub,
+        "etapas": resultados,
+    }
+
+    texto = json.dumps(saida, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if args.comparar:
+        comparar(saida, args.comparar)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
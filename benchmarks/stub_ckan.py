@@ -0,0 +1,302 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from cliente_aneel import ESTADOS_BR, RES_GD_FOTO, RES_GD_INFO, RES_USINAS
+
+# Servidor local que imita o datastore_search do CKAN da ANEEL (resource_id,
+# limit, offset, filters, fields -> total, records, fields), com dados
+# sinteticos no formato dos tres recursos. Os registros sao gerados por
+# posicao a cada pagina, entao milhoes de linhas cabem em poucos arrays.
+#
+#   python -m benchmarks.stub_ckan --porta 8765 --gd 2000000 --latencia 0.05 --taxa-erro 0.01
+
+# Peso aproximado de cada UF no cadastro de GD
+PESOS_UF = {"SP": 16, "MG": 15, "RS": 9, "PR": 9, "SC": 6, "GO": 5, "MT": 5, "BA": 5, "RJ": 5, "CE": 3, "PE": 3, "MS": 3, "ES": 3}
+
+FONTES_USINAS = ["H\u00eddrica", "F\u00f3ssil", "E\u00f3lica", "Solar", "Biomassa", "Nuclear"]
+FONTES_GD     = ["Radia\u00e7\u00e3o solar", "E\u00f3lica", "Hidr\u00e1ulica", "Biog\u00e1s", "Biomassa"]
+FASES_USINAS  = ["Opera\u00e7\u00e3o", "Constru\u00e7\u00e3o", "Constru\u00e7\u00e3o n\u00e3o iniciada"]
+CLASSES_GD    = ["Residencial", "Comercial", "Rural", "Industrial", "Poder P\u00fablico"]
+FABRICANTES_MODULO   = ["Canadian Solar", "Jinko", "Trina", "BYD", "Longi", "JA Solar", "Risen"]
+FABRICANTES_INVERSOR = ["Growatt", "Fronius", "WEG", "Huawei", "SMA", "Sungrow"]
+
+DATA_GERACAO = "2026-10-01"
+
+def _numero_br(valor, casas):
+    texto = ("%." + str(casas) + "f") % valor
+    inteiro, _, decimal = texto.partition(".")
+    grupos = []
+    while len(inteiro) > 3 and inteiro[-4] != "-":
+        grupos.insert(0, inteiro[-3:])
+        inteiro = inteiro[:-3]
+    grupos.insert(0, inteiro)
+    return ".".join(grupos) + ("," + decimal if decimal else "")
+
+class Recurso:
+    # Colunas filtraveis ficam em arrays de codigos; o resto sai de gerar(i)
+
+    def __init__(self, n, colunas, gerar, filtraveis):
+        self.n = n
+        self.colunas = colunas
+        self.gerar = gerar
+        self.filtraveis = filtraveis
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def posicoes(self, filtros):
+        if not filtros:
+            return None
+        chave = json.dumps(filtros, sort_keys=True)
+        with self._lock:
+            if chave in self._cache:
+                return self._cache[chave]
+        mascara = np.ones(self.n, dtype=bool)
+        for coluna, valor in filtros.items():
+            if coluna not in self.filtraveis:
+                raise KeyError(coluna)
+            codigos, converter = self.filtraveis[coluna]
+            pedidos = [converter(v) for v in (valor if isinstance(valor, list) else [valor])]
+            mascara &= np.isin(codigos, np.array(pedidos, dtype=codigos.dtype))
+        pos = np.flatnonzero(mascara)
+        with self._lock:
+            if len(self._cache) > 512:
+                self._cache.clear()
+            self._cache[chave] = pos
+        return pos
+
+    def pagina(self, filtros, offset, limit, campos):
+        pos = self.posicoes(filtros)
+        total = self.n if pos is None else len(pos)
+        fim = min(offset + limit, total)
+        indices = range(offset, fim) if pos is None else pos[offset:fim].tolist()
+        campos = campos or self.colunas
+        registros = []
+        for i in indices:
+            linha = self.gerar(i)
+            registros.append({c: linha.get(c) for c in campos})
+        return total, registros, campos
+
+def _codigo_lista(lista):
+    indice = {v: i for i, v in enumerate(lista)}
+    return lambda v: indice.get(v, -1)
+
+def _sortear(rng, n, opcoes, pesos=None):
+    p = None
+    if pesos is not None:
+        p = np.asarray(pesos, dtype=float)
+        p = p / p.sum()
+    return rng.choice(len(opcoes), size=n, p=p).astype(np.int16)
+
+def _coordenadas(rng, n, falta):
+    lat = rng.uniform(-33.7, 5.2, n).astype(np.float32)
+    lon = rng.uniform(-73.9, -34.8, n).astype(np.float32)
+    return lat, lon, rng.random(n) < falta
+
+def criar_usinas(n, semente=1):
+    rng = np.random.default_rng(semente)
+    uf = _sortear(rng, n, ESTADOS_BR, [PESOS_UF.get(u, 1) for u in ESTADOS_BR])
+    fonte = _sortear(rng, n, FONTES_USINAS, [30, 25, 20, 15, 9, 1])
+    fase = _sortear(rng, n, FASES_USINAS, [80, 12, 8])
+    potencia = rng.lognormal(9, 2, n).astype(np.float32)
+    lat, lon, sem_coord = _coordenadas(rng, n, 0.01)
+
+    def gerar(i):
+        return {
+            "_id": i + 1,
+            "DatGeracaoConjuntoDados": DATA_GERACAO,
+            "CodCEG": "UFV.RS." + ESTADOS_BR[uf[i]] + ".%06d-%d.01" % (i, i % 10),
+            "SigUFPrincipal": ESTADOS_BR[uf[i]],
+            "DscOrigemCombustivel": FONTES_USINAS[fonte[i]],
+            "DscFaseUsina": FASES_USINAS[fase[i]],
+            "NomEmpreendimento": "Usina " + str(i),
+            "MdaPotenciaOutorgadaKw": _numero_br(float(potencia[i]), 2),
+            "MdaPotenciaFiscalizadaKw": _numero_br(float(potencia[i]) * 0.98, 2),
+            "NumCoordNEmpreendimento": None if sem_coord[i] else _numero_br(float(lat[i]), 6),
+            "NumCoordEEmpreendimento": None if sem_coord[i] else _numero_br(float(lon[i]), 6),
+            "DscTipoGeracao": "Central Geradora",
+        }
+
+    return Recurso(n, list(gerar(0)), gerar, {
+        "SigUFPrincipal": (uf, _codigo_lista(ESTADOS_BR)),
+        "DscFaseUsina":   (fase, _codigo_lista(FASES_USINAS)),
+    })
+
+def codigo_gd(i):
+    return "GD.%09d" % i
+
+def _indice_codigo_gd(valor):
+    try:
+        return int(str(valor).strip().rsplit(".", 1)[-1])
+    except ValueError:
+        return -1
+
+def criar_gd_info(n, semente=2):
+    rng = np.random.default_rng(semente)
+    uf = _sortear(rng, n, ESTADOS_BR, [PESOS_UF.get(u, 1) for u in ESTADOS_BR])
+    fonte = _sortear(rng, n, FONTES_GD, [97, 1, 1, 0.5, 0.5])
+    classe = _sortear(rng, n, CLASSES_GD, [70, 15, 10, 4, 1])
+    potencia = rng.lognormal(2, 0.8, n).astype(np.float32)
+    lat, lon, sem_coord = _coordenadas(rng, n, 0.02)
+
+    def gerar(i):
+        return {
+            "_id": i + 1,
+            "DatGeracaoConjuntoDados": DATA_GERACAO,
+            "CodEmpreendimento": codigo_gd(i),
+            "SigUF": ESTADOS_BR[uf[i]],
+            "NomMunicipio": "Municipio " + str(i % 5570),
+            "DscFonteGeracao": FONTES_GD[fonte[i]],
+            "DscClasseConsumo": CLASSES_GD[classe[i]],
+            "NomTitularEmpreendimento": "Titular " + str(i),
+            "MdaPotenciaInstaladaKW": _numero_br(float(potencia[i]), 2),
+            "NumCoordNEmpreendimento": None if sem_coord[i] else _numero_br(float(lat[i]), 6),
+            "NumCoordEEmpreendimento": None if sem_coord[i] else _numero_br(float(lon[i]), 6),
+            "DthAtualizaCadastralEmpreend": DATA_GERACAO,
+        }
+
+    return Recurso(n, list(gerar(0)), gerar, {
+        "SigUF": (uf, _codigo_lista(ESTADOS_BR)),
+    })
+
+def criar_gd_foto(n, n_gd, semente=3):
+    # Cada linha aponta para um empreendimento do GD Info; com n > n_gd ha
+    # codigos repetidos, como no GD Foto real
+    rng = np.random.default_rng(semente)
+    codigo = (np.arange(n) % max(n_gd, 1)).astype(np.int64)
+    modulo = _sortear(rng, n, FABRICANTES_MODULO)
+    inversor = _sortear(rng, n, FABRICANTES_INVERSOR)
+
+    def gerar(i):
+        return {
+            "_id": i + 1,
+            "CodGeracaoDistribuida": codigo_gd(int(codigo[i])),
+            "MdaAreaArranjo": _numero_br(10 + i % 90, 2),
+            "MdaPotenciaInstalada": _numero_br(1 + i % 75, 2),
+            "NomFabricanteModulo": FABRICANTES_MODULO[modulo[i]],
+            "NomFabricanteInversor": FABRICANTES_INVERSOR[inversor[i]],
+            "QtdModulos": str(4 + i % 40),
+        }
+
+    return Recurso(n, list(gerar(0)), gerar, {
+        "CodGeracaoDistribuida": (codigo, _indice_codigo_gd),
+    })
+
+def criar_dados(n_usinas, n_gd, n_foto):
+    return {
+        RES_USINAS:  criar_usinas(n_usinas),
+        RES_GD_INFO: criar_gd_info(n_gd),
+        RES_GD_FOTO: criar_gd_foto(n_foto, n_gd),
+    }
+
+class StubCKAN(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, endereco, dados, latencia=0.0, taxa_erro=0.0, semente=0, max_linhas=32000):
+        super().__init__(endereco, _Handler)
+        self.dados = dados
+        # Teto de linhas por resposta, como o ckan.datastore.search.rows_max
+        self.max_linhas = max_linhas
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.aleatorio = random.Random(semente)
+        self.lock = threading.Lock()
+        self.estatisticas = {"requisicoes": 0, "erros_injetados": 0, "registros": 0}
+
+    def contar(self, chave, valor=1):
+        with self.lock:
+            self.estatisticas[chave] += valor
+
+    def sortear_erro(self):
+        with self.lock:
+            if self.aleatorio.random() >= self.taxa_erro:
+                return None
+            return self.aleatorio.choice([429, 500, 502, 503])
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo, cabecalhos=None):
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/_stats"):
+            with self.server.lock:
+                self._responder(200, dict(self.server.estatisticas))
+            return
+
+        self.server.contar("requisicoes")
+        if self.server.latencia:
+            time.sleep(self.server.latencia)
+
+        erro = self.server.sortear_erro()
+        if erro is not None:
+            self.server.contar("erros_injetados")
+            cabecalhos = {"Retry-After": "1"} if erro == 429 else None
+            self._responder(erro, {"success": False, "error": {"message": "erro injetado"}}, cabecalhos)
+            return
+
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        recurso = self.server.dados.get(q.get("resource_id"))
+        if recurso is None:
+            self._responder(404, {"success": False, "error": {"message": "Not found: Resource"}})
+            return
+        try:
+            filtros = json.loads(q["filters"]) if "filters" in q else None
+            campos = q["fields"].split(",") if "fields" in q else None
+            if campos and any(c not in recurso.colunas for c in campos):
+                raise KeyError(campos)
+            total, registros, campos = recurso.pagina(
+                filtros, int(q.get("offset", 0)), min(int(q.get("limit", 100)), self.server.max_linhas), campos
+            )
+        except (KeyError, ValueError) as e:
+            self._responder(409, {"success": False, "error": {"message": "filtro ou campo invalido: " + str(e)}})
+            return
+
+        self.server.contar("registros", len(registros))
+        fields = [{"id": c, "type": "int" if c == "_id" else "text"} for c in campos]
+        self._responder(200, {"success": True, "result": {
+            "resource_id": q["resource_id"], "total": total, "records": registros, "fields": fields,
+            "offset": int(q.get("offset", 0)), "limit": int(q.get("limit", 100)),
+        }})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.stub_ckan", description="Stub local do datastore_search da ANEEL.")
+    parser.add_argument("--porta", type=int, default=8765, help="0 escolhe uma porta livre")
+    parser.add_argument("--usinas", type=int, default=30000)
+    parser.add_argument("--gd", type=int, default=200000)
+    parser.add_argument("--foto", type=int, default=200000)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por requisicao")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fracao de respostas 429/5xx")
+    parser.add_argument("--max-linhas", type=int, default=32000, help="teto de linhas por resposta")
+    args = parser.parse_args(argv)
+
+    dados = criar_dados(args.usinas, args.gd, args.foto)
+    servidor = StubCKAN(("127.0.0.1", args.porta), dados, args.latencia, args.taxa_erro, max_linhas=args.max_linhas)
+    # A primeira linha informa a URL, para quem iniciou o stub como subprocesso
+    print("http://127.0.0.1:" + str(servidor.server_address[1]) + "/api/3/action/datastore_search", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import csv
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from normalizacao import (
+    COLS_FABRICANTE, COLS_FINAIS, COLS_FLOAT32, COORD_LAT, COORD_LON, POTENCIA_GD,
+    POTENCIA_USINAS, RENOMEAR_GD, RENOMEAR_USINAS, compactar, concatenar_compacto,
+    detectar_tipo, normalizar_arquivo,
+)
+
+EXTENSOES_LEITURA = ["csv", "gz", "zst", "parquet"]
+
+# Colunas lidas de cada tipo de arquivo; as demais nem saem do disco
+COLUNAS_POR_TIPO = {
+    "processado": COLS_FINAIS,
+    "usina": list(RENOMEAR_USINAS) + [POTENCIA_USINAS, COORD_LAT, COORD_LON, "DscFaseUsina"] + COLS_FABRICANTE,
+    "gd":    list(RENOMEAR_GD) + [POTENCIA_GD, COORD_LAT, COORD_LON] + COLS_FABRICANTE,
+    None:    COLS_FINAIS,
+}
+
+BYTES_POR_BLOCO = 16 << 20
+
+def _compressao(nome):
+    nome = nome.lower()
+    if nome.endswith(".gz"):
+        return "gzip"
+    if nome.endswith(".zst"):
+        return "zstd"
+    return None
+
+def _abrir(arquivo, nome):
+    # Caminho em disco, upload em memoria (BytesIO) ou outro objeto de arquivo
+    if isinstance(arquivo, str):
+        entrada = pa.memory_map(arquivo)
+    elif hasattr(arquivo, "getbuffer"):
+        entrada = pa.BufferReader(pa.py_buffer(arquivo.getbuffer()))
+    else:
+        arquivo.seek(0)
+        entrada = pa.PythonFile(arquivo, mode="r")
+    compressao = _compressao(nome)
+    return pa.CompressedInputStream(entrada, compressao) if compressao else entrada
+
+def _cabecalho_csv(arquivo, nome):
+    inicio = _abrir(arquivo, nome).read(1 << 16)
+    linha = inicio.split(b"\n", 1)[0].decode("utf-8-sig", errors="replace").rstrip("\r")
+    delimitador = ";" if linha.count(";") > linha.count(",") else ","
+    return next(csv.reader([linha], delimiter=delimitador)), delimitador
+
+def _tipos(colunas, tipo):
+    # Tudo como texto, exceto as medidas de um arquivo ja processado
+    return {c: pa.float64() if tipo == "processado" and c in COLS_FLOAT32 else pa.string() for c in colunas}
+
+def iterar_lotes(arquivo, nome):
+    # Detecta o tipo pelo cabecalho e le em blocos apenas as colunas usadas.
+    # Devolve (tipo, iterador de RecordBatch).
+    if nome.lower().endswith(".parquet"):
+        pf = pq.ParquetFile(_abrir(arquivo, nome))
+        tipo = detectar_tipo(pf.schema_arrow.names)
+        colunas = [c for c in COLUNAS_POR_TIPO[tipo] if c in pf.schema_arrow.names]
+        return tipo, pf.iter_batches(batch_size=200_000, columns=colunas)
+
+    nomes, delimitador = _cabecalho_csv(arquivo, nome)
+    tipo = detectar_tipo(nomes)
+    colunas = [c for c in COLUNAS_POR_TIPO[tipo] if c in nomes]
+    leitor = pa_csv.open_csv(
+        _abrir(arquivo, nome),
+        read_options=pa_csv.ReadOptions(block_size=BYTES_POR_BLOCO),
+        parse_options=pa_csv.ParseOptions(delimiter=delimitador),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=colunas,
+            column_types=_tipos(colunas, tipo),
+            strings_can_be_null=True,
+        ),
+    )
+    return tipo, leitor
+
+def carregar_arquivo(arquivo, nome):
+    # Cada bloco e normalizado e filtrado assim que e lido, entao o pico de
+    # memoria fica perto do tamanho final do DataFrame compacto.
+    _, lotes = iterar_lotes(arquivo, nome)
+    partes = []
+    for lote in lotes:
+        if lote.num_rows:
+            partes.append(normalizar_arquivo(lote.to_pandas()))
+    if not partes:
+        return normalizar_arquivo(pa.table({c: pa.array([], pa.string()) for c in COLS_FINAIS}).to_pandas())
+    return compactar(concatenar_compacto(partes))
@@ -0,0 +1,129 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+import snapshot
+
+# Paginas ja recebidas de um download grande ficam em disco ate o download
+# terminar; se ele cair no meio, a proxima tentativa so busca o que falta.
+
+CHECKPOINT_ATIVO = os.environ.get("ANEEL_CHECKPOINT_PAGINAS", "1") != "0"
+OPCOES_IPC = ipc.IpcWriteOptions(compression="zstd")
+
+def _diretorio_base(diretorio=None):
+    return os.path.join(diretorio or snapshot.CACHE_DIR, "parciais")
+
+class CheckpointPaginas:
+    # Um diretorio por consulta (recurso, filtros, campos), com um arquivo
+    # Arrow por pagina e um meta.json com o total esperado. O tamanho das
+    # paginas varia, entao cada arquivo guarda seu offset e numero de linhas.
+
+    def __init__(self, resource_id, filters, fields, total, diretorio=None, ttl=None):
+        consulta = json.dumps([resource_id, filters, fields], sort_keys=True)
+        self.caminho = os.path.join(_diretorio_base(diretorio), hashlib.sha1(consulta.encode("utf-8")).hexdigest()[:16])
+        self.total = total
+        self.salvos = {}
+        self._inicios = []
+        self._lock = threading.Lock()
+
+        meta = self._ler_meta()
+        ttl = snapshot.SNAPSHOT_TTL if ttl is None else ttl
+        # Total diferente ou checkpoint antigo: a base mudou, recomeca do zero
+        if meta is not None and (meta.get("total") != total or time.time() - meta.get("gerado_em", 0) > ttl):
+            self.descartar()
+            meta = None
+        if meta is None:
+            os.makedirs(self.caminho, exist_ok=True)
+            self._gravar_meta({"consulta": consulta, "total": total, "gerado_em": time.time()})
+        else:
+            for nome in os.listdir(self.caminho):
+                if nome.startswith("pagina_") and nome.endswith(".arrow"):
+                    offset, _, linhas = nome[len("pagina_"):-len(".arrow")].partition("_")
+                    if offset.isdigit() and linhas.isdigit():
+                        self.salvos[int(offset)] = int(linhas)
+            self._inicios = sorted(self.salvos)
+
+    def _ler_meta(self):
+        try:
+            with open(os.path.join(self.caminho, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _gravar_meta(self, meta):
+        destino = os.path.join(self.caminho, "meta.json")
+        with open(destino + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(destino + ".tmp", destino)
+
+    def _arquivo(self, offset, linhas):
+        return os.path.join(self.caminho, "pagina_" + str(offset) + "_" + str(linhas) + ".arrow")
+
+    def cobrindo(self, posicao):
+        # Pagina salva que contem a posicao: (offset, linhas) ou None
+        with self._lock:
+            i = bisect.bisect_right(self._inicios, posicao) - 1
+            if i >= 0 and posicao < self._inicios[i] + self.salvos[self._inicios[i]]:
+                return self._inicios[i], self.salvos[self._inicios[i]]
+        return None
+
+    def proximo_inicio(self, posicao):
+        # Offset da primeira pagina salva depois da posicao
+        with self._lock:
+            i = bisect.bisect_right(self._inicios, posicao)
+            return self._inicios[i] if i < len(self._inicios) else None
+
+    def ler(self, offset):
+        linhas = self.salvos.get(offset)
+        if linhas is None:
+            return None
+        try:
+            with pa.memory_map(self._arquivo(offset, linhas)) as origem:
+                return ipc.open_file(origem).read_all()
+        except (OSError, pa.ArrowException):
+            # Arquivo sumiu ou ficou corrompido: a pagina e buscada de novo
+            with self._lock:
+                self.salvos.pop(offset, None)
+                self._inicios = sorted(self.salvos)
+            return None
+
+    def gravar(self, offset, tabela):
+        destino = self._arquivo(offset, tabela.num_rows)
+        temporario = destino + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+        try:
+            with ipc.new_file(temporario, tabela.schema, options=OPCOES_IPC) as escritor:
+                escritor.write_table(tabela)
+            os.replace(temporario, destino)
+        except OSError as e:
+            print("Erro gravando checkpoint offset=" + str(offset) + ": " + str(e))
+            return
+        with self._lock:
+            self.salvos[offset] = tabela.num_rows
+            self._inicios = sorted(self.salvos)
+
+    def descartar(self):
+        shutil.rmtree(self.caminho, ignore_errors=True)
+        with self._lock:
+            self.salvos = {}
+            self._inicios = []
+
+def limpar_checkpoints(diretorio=None, ttl=None):
+    # Remove checkpoints abandonados mais antigos que o TTL dos snapshots
+    base = _diretorio_base(diretorio)
+    ttl = snapshot.SNAPSHOT_TTL if ttl is None else ttl
+    if not os.path.isdir(base):
+        return 0
+    removidos = 0
+    for nome in os.listdir(base):
+        caminho = os.path.join(base, nome)
+        if time.time() - os.path.getmtime(caminho) > ttl:
+            shutil.rmtree(caminho, ignore_errors=True)
+            removidos += 1
+    return removidos
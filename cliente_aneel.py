@@ -0,0 +1,438 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyarrow as pa
+import requests
+from requests.adapters import HTTPAdapter
+
+import metricas
+from checkpoint import CHECKPOINT_ATIVO, CheckpointPaginas
+from controle_vazao import STATUS_SOBRECARGA, ControleVazao, retry_after
+
+# Pode apontar para outro servidor CKAN, como o stub de benchmarks/stub_ckan.py
+BASE_URL = os.environ.get("ANEEL_BASE_URL", "https://dadosabertos.aneel.gov.br/api/3/action/datastore_search")
+RES_USINAS  = "11ec447d-698d-4ab8-977f-b424d5deee6a"
+RES_GD_INFO = "b1bd71e7-d0ad-4214-9053-cbd58e9564a7"
+RES_GD_FOTO = "49fa9ca0-f609-4ae3-a6f7-b97bd0945a3a"
+UF_COL_USINAS  = "SigUFPrincipal"
+UF_COL_GD_INFO = "SigUF"
+
+UF_COLUNAS = {
+    RES_USINAS:  UF_COL_USINAS,
+    RES_GD_INFO: UF_COL_GD_INFO,
+    RES_GD_FOTO: None,
+}
+
+NOMES_RECURSOS = {
+    RES_USINAS:  "usinas",
+    RES_GD_INFO: "gd_info",
+    RES_GD_FOTO: "gd_foto",
+}
+
+# Colunas e filtros enviados a API no modo dashboard. O modo Baixar Base
+# Bruta continua baixando todas as colunas e linhas.
+CAMPOS_USINAS = [
+    "CodCEG", "NomEmpreendimento", "SigUFPrincipal", "DscOrigemCombustivel",
+    "MdaPotenciaOutorgadaKw", "NumCoordNEmpreendimento", "NumCoordEEmpreendimento",
+]
+CAMPOS_GD_INFO = [
+    "CodEmpreendimento", "NomTitularEmpreendimento", "SigUF", "DscFonteGeracao",
+    "MdaPotenciaInstaladaKW", "NumCoordNEmpreendimento", "NumCoordEEmpreendimento",
+]
+CAMPOS_GD_FOTO = ["CodGeracaoDistribuida", "NomFabricanteModulo", "NomFabricanteInversor"]
+FILTROS_USINAS = {"DscFaseUsina": "Opera\u00e7\u00e3o"}
+
+PROJECOES = {
+    RES_USINAS:  (CAMPOS_USINAS,  FILTROS_USINAS),
+    RES_GD_INFO: (CAMPOS_GD_INFO, None),
+    RES_GD_FOTO: (CAMPOS_GD_FOTO, None),
+}
+
+# Teto global de requisicoes simultaneas a API (o limite efetivo se ajusta
+# abaixo dele conforme as respostas), paginas em voo por download e downloads
+# de UFs/shards em paralelo. Todos dividem a mesma sessao HTTP.
+MAX_REQUISICOES          = int(os.environ.get("ANEEL_MAX_REQUISICOES", "8"))
+MAX_CONCORRENCIA_PAGINAS = int(os.environ.get("ANEEL_MAX_CONCORRENCIA_PAGINAS", str(MAX_REQUISICOES)))
+MAX_DOWNLOADS_PARALELOS  = int(os.environ.get("ANEEL_MAX_DOWNLOADS_PARALELOS", str(MAX_REQUISICOES)))
+
+# Tamanho de pagina adaptativo: comeca em TAMANHO_PAGINA_INICIAL e varia
+# entre TAMANHO_PAGINA_MIN e o teto do CKAN buscando respostas em ALVO_RESPOSTA_S
+TAMANHO_PAGINA_INICIAL = int(os.environ.get("ANEEL_TAMANHO_PAGINA", "5000"))
+TAMANHO_PAGINA_MIN     = 500
+TAMANHO_PAGINA_MAX     = int(os.environ.get("ANEEL_TAMANHO_PAGINA_MAX", "32000"))
+ALVO_RESPOSTA_S        = float(os.environ.get("ANEEL_ALVO_RESPOSTA_S", "5"))
+MAX_TENTATIVAS         = 6
+TIMEOUT_S              = 120
+
+# Codigos por requisicao ao consultar o GD Foto filtrando por codigo
+TAMANHO_LOTE_CODIGOS = 200
+
+ESTADOS_BR = sorted([
+    "AC","AL","AM","AP","BA","CE","DF","ES","GO",
+    "MA","MG","MS","MT","PA","PB","PE","PI","PR",
+    "RJ","RN","RO","RR","RS","SC","SE","SP","TO"
+])
+
+def make_session(pool_size=MAX_REQUISICOES):
+    # As retentativas ficam em fetch_page, que conhece o controle de vazao
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=0, pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+_session = None
+_session_lock = threading.Lock()
+# Concorrencia e tamanho de pagina compartilhados por todos os recursos e UFs
+controle = ControleVazao(
+    MAX_REQUISICOES, TAMANHO_PAGINA_INICIAL, TAMANHO_PAGINA_MIN, TAMANHO_PAGINA_MAX, ALVO_RESPOSTA_S
+)
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+class ConsultaRecusada(RuntimeError):
+    # A API respondeu e recusou a consulta (success=false, ex.: HTTP 409 por
+    # um campo ou filtro invalido). Repetir a mesma consulta nao adianta.
+    pass
+
+def fetch_page(session, resource_id, offset, limit, filters=None, fields=None):
+    params = {
+        "resource_id": resource_id,
+        "limit": limit,
+        "offset": offset,
+    }
+    if filters:
+        params["filters"] = json.dumps(filters)
+    if fields:
+        params["fields"] = ",".join(fields)
+
+    recurso = NOMES_RECURSOS.get(resource_id, resource_id)
+    inicio = time.perf_counter()
+    espera = 0.0
+    tentativa = 0
+    while True:
+        tentativa += 1
+        pausa = None
+        try:
+            with controle.requisicao() as aguardou:
+                espera += aguardou
+                inicio_req = time.perf_counter()
+                response = session.get(BASE_URL, params=params, timeout=(10, TIMEOUT_S))
+                duracao = time.perf_counter() - inicio_req
+
+            if response.status_code in STATUS_SOBRECARGA:
+                # API sobrecarregada: reduz a concorrencia e tenta de novo
+                pausa = retry_after(response)
+                motivo = "HTTP " + str(response.status_code)
+                controle.registrar_sobrecarga(resource_id, pausa)
+            else:
+                inicio_parse = time.perf_counter()
+                data = response.json()
+                fim = time.perf_counter()
+                if not data.get("success", False):
+                    erro = data.get("error") or {}
+                    raise ConsultaRecusada(
+                        "API recusou a consulta (HTTP " + str(response.status_code) + ")" +
+                        (": " + str(erro.get("message")) if isinstance(erro, dict) and erro.get("message") else "")
+                    )
+                break
+        except requests.Timeout as e:
+            motivo = "timeout: " + str(e)
+            controle.registrar_sobrecarga(resource_id, timeout=True)
+        except requests.ConnectionError as e:
+            motivo = "conexao: " + str(e)
+        except Exception as e:
+            metricas.registrar_erro(recurso, offset, str(e))
+            raise
+
+        metricas.registrar_sobrecarga(recurso, offset, motivo)
+        _publicar_controle()
+        if tentativa >= MAX_TENTATIVAS:
+            metricas.registrar_erro(recurso, offset, motivo)
+            raise RuntimeError("API indisponivel apos " + str(tentativa) + " tentativas (" + motivo + ")")
+        time.sleep(controle.espera_retentativa(tentativa, pausa))
+
+    n_registros = len(data["result"].get("records", []))
+    controle.registrar_sucesso(resource_id, limit, n_registros, duracao)
+    _publicar_controle()
+    metricas.registrar_requisicao(
+        recurso, offset, fim - inicio, espera, fim - inicio_parse,
+        len(response.content), n_registros, tentativa - 1,
+    )
+    return data["result"]
+
+def _publicar_controle():
+    estado = controle.estado()
+    estado["paginas"] = {NOMES_RECURSOS.get(k, k): v for k, v in estado["paginas"].items()}
+    metricas.registrar_controle(estado)
+
+TIPOS_INTEIROS = {"int", "int4", "int8", "integer", "bigint"}
+
+def records_para_tabela(records, fields=None):
+    # Converte uma pagina de registros em uma tabela colunar tipada; os
+    # dicts da pagina podem ser descartados logo em seguida.
+    if fields:
+        nomes = [f["id"] for f in fields]
+        tipos = {f["id"]: f.get("type", "text") for f in fields}
+    else:
+        nomes = list(records[0].keys()) if records else []
+        tipos = {"_id": "int"}
+
+    colunas = {}
+    for nome in nomes:
+        valores = [r.get(nome) for r in records]
+        if tipos.get(nome, "text") in TIPOS_INTEIROS:
+            colunas[nome] = pa.array(valores, type=pa.int64())
+            continue
+        try:
+            colunas[nome] = pa.array(valores, type=pa.string())
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            colunas[nome] = pa.array([None if v is None else str(v) for v in valores], type=pa.string())
+    return pa.table(colunas)
+
+def concatenar_tabelas(tabelas):
+    tabelas = [t for t in tabelas if t.num_columns > 0]
+    if not tabelas:
+        return pa.table({})
+    return pa.concat_tables(tabelas, promote_options="default")
+
+def tabela_para_df(tabela, total=None):
+    df = tabela.to_pandas(self_destruct=True)
+    df.attrs["total"] = total
+    return df
+
+def abrir_paginas(resource_id, filters=None, limit_per_page=None, progress_bar=None, max_workers=None, fields=None):
+    # limit_per_page=None usa o tamanho adaptativo do controle de vazao
+    session = get_session()
+    primeiro = limit_per_page or controle.tamanho_pagina(resource_id)
+    result = fetch_page(session, resource_id, 0, primeiro, filters, fields)
+    total = result.get("total", 0)
+    return total, _iterar_paginas(
+        session, resource_id, filters, fields, limit_per_page, progress_bar,
+        max_workers or MAX_CONCORRENCIA_PAGINAS, result, total, primeiro
+    )
+
+class DownloadIncompleto(RuntimeError):
+    # A API anunciou mais registros do que foi possivel receber. Nunca deve
+    # ser tratado como resultado completo (nem ir para cache ou snapshot).
+
+    def __init__(self, recurso, recebidos, total, motivo=""):
+        if total is None:
+            mensagem = "Download de " + recurso + " falhou na primeira pagina"
+        else:
+            mensagem = "Download incompleto de " + recurso + ": " + str(recebidos) + " de " + str(total) + " registros"
+        super().__init__(mensagem + (" (" + motivo + ")" if motivo else ""))
+        self.recurso = recurso
+        self.recebidos = recebidos
+        self.total = total
+
+def _iterar_paginas(session, resource_id, filters, fields_req, limit_per_page, progress_bar, max_workers, primeira, total, pedido):
+    recurso = NOMES_RECURSOS.get(resource_id, resource_id)
+    fields = primeira.get("fields")
+    recebidos = 0
+
+    def atualizar_progresso():
+        if progress_bar is not None and total > 0:
+            progress_bar.progress(
+                min(recebidos / total, 1.0),
+                text=str(min(recebidos, total)) + " / " + str(total) + " registros"
+            )
+
+    def interromper(offset, motivo):
+        print("Erro offset=" + str(offset) + ": " + motivo)
+        metricas.registrar_interrupcao(recurso, offset, recebidos, total, motivo)
+        return DownloadIncompleto(recurso, recebidos, total, motivo)
+
+    records = primeira.get("records", [])
+    if not records:
+        if total > 0:
+            raise interromper(0, "pagina vazia")
+        return
+    # Menos linhas que o pedido sem ser o fim: e o teto de linhas do servidor
+    if len(records) < min(pedido, total):
+        controle.limitar_pagina(resource_id, len(records))
+    recebidos += len(records)
+    atualizar_progresso()
+    yield records_para_tabela(records, fields)
+    del primeira, records
+
+    # Downloads de mais de uma pagina guardam cada pagina recebida em disco;
+    # numa nova tentativa as paginas salvas sao lidas em vez de baixadas.
+    checkpoint = None
+    if CHECKPOINT_ATIVO and total > recebidos:
+        checkpoint = CheckpointPaginas(resource_id, filters, fields_req, total)
+        if checkpoint.salvos:
+            metricas.registrar_retomada(recurso, len(checkpoint.salvos))
+
+    def planejar(posicao):
+        # Proxima faixa (offset, linhas) a partir da posicao: o resto de uma
+        # pagina salva ou uma pagina nova que para antes da proxima salva
+        if checkpoint is not None:
+            salva = checkpoint.cobrindo(posicao)
+            if salva is not None:
+                return posicao, salva[0] + salva[1] - posicao
+        n = min(limit_per_page or controle.tamanho_pagina(resource_id), total - posicao)
+        if checkpoint is not None:
+            inicio_salvo = checkpoint.proximo_inicio(posicao)
+            if inicio_salvo is not None:
+                n = min(n, inicio_salvo - posicao)
+        return posicao, n
+
+    def buscar(offset, n):
+        if checkpoint is not None:
+            salva = checkpoint.cobrindo(offset)
+            if salva is not None:
+                tabela = checkpoint.ler(salva[0])
+                if tabela is not None:
+                    return tabela.slice(offset - salva[0], n)
+        result = fetch_page(session, resource_id, offset, n, filters, fields_req)
+        records = result.get("records", [])
+        if not records:
+            return None
+        tabela = records_para_tabela(records, result.get("fields") or fields)
+        # Pagina curta nao vai para o checkpoint, senao a falta se repetiria
+        if checkpoint is not None and tabela.num_rows == n:
+            checkpoint.gravar(offset, tabela)
+        return tabela
+
+    # Com o total conhecido, as paginas restantes sao buscadas em paralelo.
+    # A janela de paginas em voo e limitada, e cada pagina e entregue em
+    # ordem de offset assim que chega a sua vez. O tamanho de cada pagina e
+    # decidido na hora de agendar, entao acompanha o controle de vazao.
+    posicao = recebidos
+    pendentes = deque()
+    ex = ThreadPoolExecutor(max_workers=max_workers)
+
+    def agendar():
+        nonlocal posicao
+        off, n = planejar(posicao)
+        posicao = off + n
+        pendentes.append((off, n, ex.submit(buscar, off, n)))
+
+    try:
+        while posicao < total and len(pendentes) < max_workers * 2:
+            agendar()
+        while pendentes:
+            off, n, fut = pendentes.popleft()
+            try:
+                tabela = fut.result()
+            except Exception as e:
+                raise interromper(off, str(e)) from e
+            if tabela is None:
+                raise interromper(off, "pagina vazia")
+            recebidos += tabela.num_rows
+            atualizar_progresso()
+            if tabela.num_rows < n:
+                # Pagina cortada pelo servidor: o resto da faixa vem antes das demais
+                controle.limitar_pagina(resource_id, tabela.num_rows)
+                resto = off + tabela.num_rows
+                pendentes.appendleft((resto, n - tabela.num_rows, ex.submit(buscar, resto, n - tabela.num_rows)))
+            yield tabela
+            del tabela
+
+            if posicao < total:
+                agendar()
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+    if recebidos < total:
+        raise interromper(total, "faltaram registros")
+    if checkpoint is not None:
+        checkpoint.descartar()
+
+def iterar_tabelas(resource_id, filters=None, limit_per_page=None, progress_bar=None, max_workers=None, fields=None, totais=None):
+    try:
+        total, paginas = abrir_paginas(resource_id, filters, limit_per_page, progress_bar, max_workers, fields)
+    except Exception as e:
+        # So uma recusa da API indica projecao invalida (ex.: coluna renomeada);
+        # rede fora ou sobrecarga falhariam igual sem a projecao
+        if not fields or not isinstance(e, ConsultaRecusada):
+            print("Erro offset=0: " + str(e))
+            raise DownloadIncompleto(NOMES_RECURSOS.get(resource_id, resource_id), 0, None, str(e)) from e
+        print("Erro com projecao de campos, baixando todas as colunas: " + str(e))
+        yield from iterar_tabelas(resource_id, filters, limit_per_page, progress_bar, max_workers, totais=totais)
+        return
+    if totais is not None:
+        totais.append(total)
+    yield from paginas
+
+def baixar_tabela(resource_id, filters=None, limit_per_page=None, progress_bar=None, max_workers=None, fields=None):
+    totais = []
+    with metricas.cronometro("download_" + NOMES_RECURSOS.get(resource_id, resource_id)) as info:
+        tabela = concatenar_tabelas(
+            iterar_tabelas(resource_id, filters, limit_per_page, progress_bar, max_workers, fields, totais)
+        )
+        info["registros"] = tabela.num_rows
+    return tabela, (totais[0] if totais else None)
+
+def fetch_all_pages(resource_id, filters=None, limit_per_page=None, progress_bar=None, max_workers=None, fields=None):
+    tabela, total = baixar_tabela(resource_id, filters, limit_per_page, progress_bar, max_workers, fields)
+    return tabela_para_df(tabela, total)
+
+def iterar_base_bruta(ufs, resource_id, uf_column, fields=None, filters=None, progress_bar=None, totais=None):
+    # Entrega as tabelas Arrow conforme chegam: paginas, no download completo,
+    # ou uma tabela por UF, no download por estados.
+    todas = set(ufs) >= set(ESTADOS_BR)
+    if todas or uf_column is None:
+        yield from iterar_tabelas(resource_id, filters, progress_bar=progress_bar, fields=fields, totais=totais)
+        return
+
+    # Uma UF que falha interrompe o conjunto: um resultado sem ela pareceria
+    # completo. As paginas ja recebidas ficam no checkpoint de cada UF.
+    ex = ThreadPoolExecutor(max_workers=min(len(ufs), MAX_DOWNLOADS_PARALELOS))
+    try:
+        futures = {
+            ex.submit(baixar_tabela, resource_id, dict(filters or {}, **{uf_column: uf}), fields=fields): uf
+            for uf in ufs
+        }
+        for fut in as_completed(futures):
+            try:
+                tabela, total_uf = fut.result()
+            except Exception as e:
+                print("Erro download UF " + futures[fut] + ": " + str(e))
+                raise
+            if totais is not None:
+                totais.append(total_uf or 0)
+            yield tabela
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+def baixar_base_bruta(ufs, resource_id, uf_column, fields=None, filters=None):
+    totais = []
+    tabela = concatenar_tabelas(iterar_base_bruta(ufs, resource_id, uf_column, fields, filters, totais=totais))
+    return tabela_para_df(tabela, sum(totais) if totais else None)
+
+def buscar_tecnicos_por_codigos(codigos):
+    # Consulta o GD Foto filtrando por lotes de codigos (filtro IN do CKAN).
+    # Devolve os registros e os codigos cujos lotes foram consultados com sucesso.
+    lotes = [codigos[i:i + TAMANHO_LOTE_CODIGOS] for i in range(0, len(codigos), TAMANHO_LOTE_CODIGOS)]
+    fields, _ = PROJECOES[RES_GD_FOTO]
+
+    def buscar_lote(lote):
+        # Lote que falha fica fora de "consultados" e e buscado numa proxima vez
+        try:
+            tabela, _ = baixar_tabela(RES_GD_FOTO, {"CodGeracaoDistribuida": lote}, fields=fields)
+        except Exception as e:
+            print("Erro consultando lote do GD Foto: " + str(e))
+            return pa.table({}), []
+        return tabela, lote
+
+    partes, consultados = [], []
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOADS_PARALELOS) as ex:
+        for tabela, ok in ex.map(buscar_lote, lotes):
+            partes.append(tabela)
+            consultados.extend(ok)
+    return tabela_para_df(concatenar_tabelas(partes)), consultados
+
+def baixar_gd_foto_nacional():
+    fields, _ = PROJECOES[RES_GD_FOTO]
+    return fetch_all_pages(RES_GD_FOTO, fields=fields)
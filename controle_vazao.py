@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Controle adaptativo das requisicoes a API, compartilhado por todos os
+# downloads do processo:
+# - concorrencia AIMD: sobe devagar a cada resposta boa e cai pela metade
+#   quando a API responde 429/5xx ou estoura o tempo;
+# - pausa global quando a API manda Retry-After;
+# - tamanho de pagina por recurso: cresce enquanto as respostas chegam
+#   rapido e encolhe com respostas lentas ou timeouts.
+
+STATUS_SOBRECARGA = {429, 500, 502, 503, 504}
+
+class ControleVazao:
+
+    def __init__(self, max_concorrencia, pagina_inicial=5000, pagina_min=500, pagina_max=32000, alvo_s=5.0):
+        self.max_concorrencia = max(1, max_concorrencia)
+        self.limite = float(max(1, self.max_concorrencia // 2))
+        self.pagina_inicial = pagina_inicial
+        self.pagina_min = pagina_min
+        self.pagina_max = pagina_max
+        self.alvo_s = alvo_s
+        self.em_uso = 0
+        self.pausa_ate = 0.0
+        self.ultima_reducao = 0.0
+        self.paginas = {}
+        self.tetos = {}
+        self.cortes = {}
+        self.sobrecargas = 0
+        self._cond = threading.Condition()
+
+    # ---------- concorrencia ----------
+
+    @contextmanager
+    def requisicao(self):
+        # Espera vaga (e o fim de uma pausa pedida pela API) e devolve o tempo de espera
+        inicio = time.perf_counter()
+        with self._cond:
+            while True:
+                pausa = self.pausa_ate - time.monotonic()
+                if pausa > 0:
+                    self._cond.wait(pausa)
+                elif self.em_uso < int(self.limite):
+                    break
+                else:
+                    self._cond.wait()
+            self.em_uso += 1
+        try:
+            yield time.perf_counter() - inicio
+        finally:
+            with self._cond:
+                self.em_uso -= 1
+                self._cond.notify_all()
+
+    def registrar_sucesso(self, resource_id, limit, registros, segundos):
+        with self._cond:
+            # Aumento aditivo: cerca de +1 vaga a cada "janela" de respostas boas
+            self.limite = min(self.max_concorrencia, self.limite + 1.0 / self.limite)
+            self._cond.notify_all()
+
+            # So paginas cheias dizem algo sobre o tamanho ideal
+            if registros < limit:
+                return
+            atual = self.paginas.get(resource_id, self.pagina_inicial)
+            if segundos < self.alvo_s / 2:
+                atual = atual * 1.5
+            elif segundos > self.alvo_s:
+                atual = atual * 0.7
+            self.paginas[resource_id] = self._limitar_pagina(resource_id, atual)
+
+    def registrar_sobrecarga(self, resource_id=None, retry_after=None, timeout=False):
+        agora = time.monotonic()
+        with self._cond:
+            self.sobrecargas += 1
+            if retry_after:
+                self.pausa_ate = max(self.pausa_ate, agora + retry_after)
+            # Reducao multiplicativa, no maximo uma vez por segundo, para que
+            # uma rajada de erros simultaneos nao derrube o limite a 1
+            if agora - self.ultima_reducao >= 1.0:
+                self.limite = max(1.0, self.limite / 2)
+                self.ultima_reducao = agora
+            # Timeout e erro de servidor costumam vir de paginas pesadas demais
+            if resource_id is not None and (timeout or not retry_after):
+                atual = self.paginas.get(resource_id, self.pagina_inicial)
+                self.paginas[resource_id] = self._limitar_pagina(resource_id, atual * (0.5 if timeout else 0.75))
+            self._cond.notify_all()
+
+    # ---------- tamanho de pagina ----------
+
+    def _limitar_pagina(self, resource_id, tamanho):
+        teto = min(self.pagina_max, self.tetos.get(resource_id, self.pagina_max))
+        return int(min(teto, max(self.pagina_min, round(tamanho / 100) * 100)))
+
+    def tamanho_pagina(self, resource_id):
+        with self._cond:
+            return self.paginas.get(resource_id, self._limitar_pagina(resource_id, self.pagina_inicial))
+
+    def limitar_pagina(self, resource_id, maximo):
+        # A API devolveu menos linhas que o pedido. So vira teto do servidor
+        # quando o mesmo corte se repete, para uma resposta truncada avulsa
+        # nao prender o recurso em paginas pequenas.
+        with self._cond:
+            if self.cortes.get(resource_id) != maximo:
+                self.cortes[resource_id] = maximo
+                return
+            self.tetos[resource_id] = max(1, maximo)
+            self.paginas[resource_id] = min(self.paginas.get(resource_id, self.pagina_inicial), self.tetos[resource_id])
+
+    # ---------- consulta ----------
+
+    def espera_retentativa(self, tentativa, retry_after=None):
+        # Backoff exponencial com jitter; Retry-After da API tem prioridade
+        espera = min(60.0, 0.5 * 2 ** (tentativa - 1)) * random.uniform(0.5, 1.0)
+        return max(espera, retry_after or 0.0)
+
+    def estado(self):
+        with self._cond:
+            return {
+                "limite_concorrencia": round(self.limite, 2),
+                "em_uso": self.em_uso,
+                "pausa_restante_s": round(max(0.0, self.pausa_ate - time.monotonic()), 1),
+                "sobrecargas": self.sobrecargas,
+                "paginas": dict(self.paginas),
+            }
+
+def retry_after(response):
+    # Aceita so o formato em segundos, o unico usado pelo CKAN
+    valor = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(valor)) if valor else None
+    except ValueError:
+        return None
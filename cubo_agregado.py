@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from indice_filtros import DIMENSOES
+
+# Limites das faixas de potencia (MW). Cada faixa guarda tambem o menor e o
+# maior valor observado, entao um intervalo do slider que vai de ponta a
+# ponta (o padrao) sempre cobre faixas inteiras.
+LIMITES_FAIXAS = [0, 0.075, 0.5, 1, 5, 10, 30, 50, 100, 300, 1000]
+
+class CuboAgregado:
+    # Contagem e MW somado por UF x Fonte x Categoria x faixa de potencia,
+    # montado uma vez por base a partir dos codigos do IndiceFiltros. As
+    # metricas e os graficos de distribuicao saem do cubo; so as linhas das
+    # faixas cortadas pelo intervalo de potencia sao lidas do indice.
+
+    def __init__(self, indice):
+        self.indice = indice
+        self.dimensoes = DIMENSOES
+        # Posicao 0 de cada eixo guarda os valores ausentes (codigo -1)
+        self.tamanhos = [len(indice.categorias[dim]) + 1 for dim in DIMENSOES]
+
+        potencia = indice.potencia
+        nan = np.isnan(potencia)
+        # A ultima faixa reune potencia ausente, que nunca passa pelo filtro de potencia
+        faixas = np.searchsorted(LIMITES_FAIXAS, potencia, side="right")
+        self.n_faixas = len(LIMITES_FAIXAS) + 2
+        faixas[nan] = self.n_faixas - 1
+        self.faixas = faixas.astype(np.int8)
+
+        forma = self.tamanhos + [self.n_faixas]
+        total = int(np.prod(forma))
+        chave = self._celulas(np.arange(indice.n, dtype=np.int64)) * self.n_faixas + self.faixas
+        self.contagem = np.bincount(chave, minlength=total).reshape(forma)
+        self.potencia_mw = np.bincount(
+            chave, weights=np.nan_to_num(potencia.astype("float64")), minlength=total
+        ).reshape(forma)
+
+        # Menor e maior potencia observada em cada faixa
+        self.faixa_min = np.full(self.n_faixas, np.inf)
+        self.faixa_max = np.full(self.n_faixas, -np.inf)
+        validos = ~nan
+        np.minimum.at(self.faixa_min, self.faixas[validos], potencia[validos].astype("float64"))
+        np.maximum.at(self.faixa_max, self.faixas[validos], potencia[validos].astype("float64"))
+
+    def _celulas(self, pos):
+        # Indice linear (Categoria, Fonte, UF) de cada linha
+        celula = np.zeros(len(pos), dtype=np.int64)
+        for dim, tamanho in zip(self.dimensoes, self.tamanhos):
+            celula = celula * tamanho + (self.indice.codigos[dim][pos].astype(np.int64) + 1)
+        return celula
+
+    def _mascara(self, dim, valores):
+        # Eixo inteiro quando o filtro esta vazio, como no IndiceFiltros
+        i = self.dimensoes.index(dim)
+        mascara = np.zeros(self.tamanhos[i], dtype=bool)
+        if not valores:
+            mascara[:] = True
+            return mascara
+        valores = set(valores)
+        for codigo, valor in enumerate(self.indice.categorias[dim]):
+            if valor in valores:
+                mascara[codigo + 1] = True
+        return mascara
+
+    def classificar_faixas(self, pot_min=None, pot_max=None):
+        # Devolve (faixas inteiras, faixas cortadas) para o intervalo
+        if pot_min is None and pot_max is None:
+            return np.ones(self.n_faixas, dtype=bool), np.zeros(self.n_faixas, dtype=bool)
+        lo = -np.inf if pot_min is None else pot_min
+        hi = np.inf if pot_max is None else pot_max
+        ocupadas = self.faixa_min <= self.faixa_max
+        inteiras = ocupadas & (self.faixa_min >= lo) & (self.faixa_max <= hi)
+        fora = ~ocupadas | (self.faixa_max < lo) | (self.faixa_min > hi)
+        return inteiras, ~inteiras & ~fora
+
+    def consultar(self, categorias=None, fontes=None, ufs=None, pot_min=None, pot_max=None, posicoes=None):
+        # Contagem e MW por (Categoria, Fonte, UF) para os filtros. Faixas
+        # cortadas pelo intervalo usam as posicoes ja filtradas (ou pedem ao indice).
+        inteiras, cortadas = self.classificar_faixas(pot_min, pot_max)
+        mascaras = [
+            self._mascara("Categoria", categorias), self._mascara("Fonte", fontes), self._mascara("UF", ufs)
+        ]
+        selecao = np.ix_(*mascaras, inteiras)
+        contagem = np.zeros(self.tamanhos, dtype=np.int64)
+        potencia = np.zeros(self.tamanhos)
+        contagem[np.ix_(*mascaras)] = self.contagem[selecao].sum(axis=-1)
+        potencia[np.ix_(*mascaras)] = self.potencia_mw[selecao].sum(axis=-1)
+
+        if cortadas.any():
+            if posicoes is None:
+                posicoes = self.indice.selecionar(categorias, fontes, ufs, pot_min, pot_max)
+            contagem_linhas, potencia_linhas = self.agregar(posicoes[cortadas[self.faixas[posicoes]]])
+            contagem += contagem_linhas
+            potencia += potencia_linhas
+        return contagem, potencia, bool(cortadas.any())
+
+    def agregar(self, pos):
+        # Mesmo formato de consultar, somando direto as linhas dadas. Serve
+        # para filtros que o cubo nao tem, como o de proximidade.
+        total = int(np.prod(self.tamanhos))
+        celulas = self._celulas(pos)
+        contagem = np.bincount(celulas, minlength=total).reshape(self.tamanhos)
+        potencia = np.bincount(
+            celulas, weights=np.nan_to_num(self.indice.potencia[pos].astype("float64")), minlength=total
+        ).reshape(self.tamanhos)
+        return contagem, potencia
+
+    def resumo(self, contagem, potencia):
+        # Metricas do topo do painel
+        por_uf = contagem.sum(axis=(0, 1))
+        por_fonte = contagem.sum(axis=(0, 2))
+        return {
+            "instalacoes": int(contagem.sum()),
+            "potencia_mw": float(potencia.sum()),
+            "ufs":         int((por_uf[1:] > 0).sum()),
+            "fontes":      int((por_fonte[1:] > 0).sum()),
+        }
+
+    def tabela(self, contagem, potencia):
+        # Celulas nao vazias em formato longo: Categoria, Fonte, UF, Instalacoes, Potencia MW
+        cat, fonte, uf = np.nonzero(contagem)
+        rotulos = [np.array(["-"] + list(self.indice.categorias[dim]), dtype=object) for dim in self.dimensoes]
+        return pd.DataFrame({
+            "Categoria":   rotulos[0][cat],
+            "Fonte":       rotulos[1][fonte],
+            "UF":          rotulos[2][uf],
+            "Instalacoes": contagem[cat, fonte, uf],
+            "Potencia MW": np.round(potencia[cat, fonte, uf], 2),
+        })
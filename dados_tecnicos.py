@@ -0,0 +1,102 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from normalizacao import COLS_FABRICANTE, limpar_codigo
+from snapshot import atualizar_em_segundo_plano, gravar_snapshot, ler_manifesto, ler_snapshot, snapshot_expirado
+
+COL_CODIGO   = "CodGeracaoDistribuida"
+COLS_LOOKUP  = [COL_CODIGO] + COLS_FABRICANTE
+CHAVE_LOOKUP = "gd_foto_lookup"
+
+# Acima deste numero de codigos desconhecidos compensa baixar a tabela
+# nacional inteira uma vez, em vez de consultar a API por lotes de codigos
+LIMITE_CODIGOS = int(os.environ.get("ANEEL_LIMITE_CODIGOS_FOTO", "50000"))
+
+_lock = threading.Lock()
+_cache = {"gerado_em": None, "lookup": None}
+
+class LookupTecnico:
+    # Dados tecnicos do GD Foto deduplicados e indexados pelo codigo
+
+    def __init__(self, df, completo=False):
+        self.df = df.reset_index(drop=True)
+        self.indice = pd.Index(self.df[COL_CODIGO])
+        self.completo = completo
+
+    def faltando(self, codigos):
+        return codigos[self.indice.get_indexer(codigos) < 0]
+
+    def consultar(self, codigos):
+        pos = self.indice.get_indexer(codigos)
+        return self.df.take(pos[pos >= 0]).reset_index(drop=True)
+
+def deduplicar(df):
+    if df.empty or COL_CODIGO not in df.columns:
+        return pd.DataFrame({c: pd.Series(dtype="string") for c in COLS_LOOKUP})
+    saida = pd.DataFrame({COL_CODIGO: limpar_codigo(df[COL_CODIGO])})
+    for col in COLS_FABRICANTE:
+        saida[col] = df[col].to_numpy() if col in df.columns else None
+    return saida.dropna(subset=[COL_CODIGO]).drop_duplicates(subset=[COL_CODIGO], keep="first")
+
+def _vazio():
+    return LookupTecnico(deduplicar(pd.DataFrame()))
+
+def carregar_lookup(diretorio=None):
+    # Reabre o arquivo so quando o manifesto indica uma nova versao
+    manifesto = ler_manifesto(CHAVE_LOOKUP, diretorio)
+    if manifesto is None:
+        return _vazio()
+    with _lock:
+        if _cache["gerado_em"] == manifesto.get("gerado_em") and _cache["lookup"] is not None:
+            return _cache["lookup"]
+    df, manifesto = ler_snapshot(CHAVE_LOOKUP, diretorio)
+    if df is None:
+        return _vazio()
+    lookup = LookupTecnico(df, manifesto.get("completo", False))
+    with _lock:
+        _cache["gerado_em"] = manifesto.get("gerado_em")
+        _cache["lookup"] = lookup
+    return lookup
+
+def gravar_lookup(df, completo, diretorio=None):
+    gravar_snapshot(CHAVE_LOOKUP, df, diretorio=diretorio, extras={"completo": completo})
+    return carregar_lookup(diretorio)
+
+def _nacional(baixar_nacional):
+    return deduplicar(baixar_nacional())
+
+def tecnicos_para(codigos, buscar_codigos, baixar_nacional, diretorio=None):
+    # Devolve apenas as linhas tecnicas dos codigos pedidos. Codigos novos sao
+    # buscados na API por lotes (buscar_codigos) ou, se forem muitos, a tabela
+    # nacional e baixada uma vez (baixar_nacional) e o lookup fica completo.
+    codigos = pd.unique(limpar_codigo(pd.Series(codigos)).dropna().to_numpy())
+    lookup = carregar_lookup(diretorio)
+
+    if lookup.completo:
+        manifesto = ler_manifesto(CHAVE_LOOKUP, diretorio)
+        if snapshot_expirado(manifesto):
+            atualizar_em_segundo_plano(
+                CHAVE_LOOKUP, lambda: _nacional(baixar_nacional), diretorio, extras={"completo": True}
+            )
+        return lookup.consultar(codigos)
+
+    faltando = lookup.faltando(codigos)
+    if len(faltando) > LIMITE_CODIGOS:
+        df_nacional = _nacional(baixar_nacional)
+        if not df_nacional.empty:
+            lookup = gravar_lookup(df_nacional, True, diretorio)
+    elif len(faltando):
+        df_novo, consultados = buscar_codigos(list(faltando))
+        if len(consultados):
+            # Codigos consultados sem dados tecnicos ficam registrados sem
+            # fabricante, para nao serem buscados de novo
+            novos = deduplicar(df_novo)
+            sem_dados = np.setdiff1d(np.asarray(consultados, dtype=object), novos[COL_CODIGO].to_numpy(dtype=object))
+            vazios = pd.DataFrame({COL_CODIGO: sem_dados})
+            lookup = gravar_lookup(
+                deduplicar(pd.concat([lookup.df, novos, vazios], ignore_index=True)), False, diretorio
+            )
+    return lookup.consultar(codigos)
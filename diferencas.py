@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from normalizacao import COLS_FINAIS, compactar, limpar_codigo
+
+# Diferencas entre duas versoes de uma base, chaveadas pelo codigo da
+# instalacao. Cada codigo tem um hash do conteudo de todas as suas linhas
+# (soma dos hashes por linha, entao a ordem das linhas nao importa).
+
+COLS_IGNORADAS = ["_id"]
+MUDANCAS = ["adicionado", "alterado", "removido"]
+
+def hashes_por_codigo(df, coluna):
+    # DataFrame com Codigo e Hash (uint64), um por codigo distinto
+    if df.empty or coluna not in df.columns:
+        return pd.DataFrame({"Codigo": pd.Series(dtype=object), "Hash": pd.Series(dtype="uint64")})
+    conteudo = df.drop(columns=[c for c in COLS_IGNORADAS if c in df.columns])
+    hashes = pd.util.hash_pandas_object(conteudo, index=False).to_numpy(dtype="uint64")
+    codigos, inverso = np.unique(limpar_codigo(df[coluna]).fillna("").to_numpy(dtype=object), return_inverse=True)
+    ordem = np.argsort(inverso, kind="stable")
+    inicios = np.searchsorted(inverso[ordem], np.arange(len(codigos)))
+    # Soma em uint64 da a volta em 2**64, o que basta para comparar
+    soma = np.add.reduceat(hashes[ordem], inicios) if len(codigos) else np.empty(0, dtype="uint64")
+    return pd.DataFrame({"Codigo": codigos, "Hash": soma.astype("uint64")})
+
+def comparar(antigos, novos):
+    # Devolve os codigos adicionados, alterados e removidos entre duas
+    # tabelas de hashes_por_codigo
+    juntos = antigos.merge(novos, on="Codigo", how="outer", suffixes=("_antigo", "_novo"), indicator=True)
+    adicionados = juntos.loc[juntos["_merge"] == "right_only", "Codigo"].to_numpy(dtype=object)
+    removidos = juntos.loc[juntos["_merge"] == "left_only", "Codigo"].to_numpy(dtype=object)
+    ambos = juntos[juntos["_merge"] == "both"]
+    alterados = ambos.loc[ambos["Hash_antigo"] != ambos["Hash_novo"], "Codigo"].to_numpy(dtype=object)
+    return adicionados, alterados, removidos
+
+def codigos_normalizados(df):
+    # Codigo da base normalizada comparavel com o de hashes_por_codigo
+    return limpar_codigo(df["Codigo"].astype(object)).fillna("").to_numpy(dtype=object)
+
+def montar_feed(novos, removidos, adicionados, detectado_em):
+    # Linhas novas (adicionadas ou alteradas) com os valores atuais e linhas
+    # removidas com os ultimos valores conhecidos
+    codigos_novos = codigos_normalizados(novos) if len(novos) else np.empty(0, dtype=object)
+    mudanca = np.where(np.isin(codigos_novos, adicionados), "adicionado", "alterado")
+    partes = [
+        novos.reindex(columns=COLS_FINAIS).assign(Mudanca=mudanca),
+        removidos.reindex(columns=COLS_FINAIS).assign(Mudanca="removido"),
+    ]
+    partes = [p.astype({c: object for c in p.columns if isinstance(p[c].dtype, pd.CategoricalDtype)})
+              for p in partes if len(p)]
+    if not partes:
+        feed = pd.DataFrame(columns=["Mudanca"] + COLS_FINAIS)
+    else:
+        feed = pd.concat(partes, ignore_index=True)[["Mudanca"] + COLS_FINAIS]
+    feed["Mudanca"] = pd.Categorical(feed["Mudanca"], categories=MUDANCAS)
+    feed["Detectado em"] = detectado_em
+    return compactar(feed)
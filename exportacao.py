@@ -0,0 +1,91 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# formato -> (extensao, mime, compressao)
+FORMATOS = {
+    "CSV":         (".csv",     "text/csv",                      None),
+    "CSV (gzip)":  (".csv.gz",  "application/gzip",              "gzip"),
+    "CSV (zstd)":  (".csv.zst", "application/zstd",              "zstd"),
+    "Parquet":     (".parquet", "application/vnd.apache.parquet", None),
+}
+
+LINHAS_POR_LOTE = 100_000
+
+def formatos_disponiveis():
+    return [f for f, (_, _, compressao) in FORMATOS.items() if compressao is None or pa.Codec.is_available(compressao)]
+
+def _abrir_saida(caminho, compressao):
+    if compressao:
+        return pa.CompressedOutputStream(caminho, compressao)
+    return pa.OSFile(caminho, "wb")
+
+def exportar_tabelas(tabelas, formato):
+    # Grava lotes Arrow em um arquivo temporario, um lote por vez.
+    # Devolve (caminho, linhas, colunas); quem chama apaga o arquivo.
+    extensao, _, compressao = FORMATOS[formato]
+    fd, caminho = tempfile.mkstemp(suffix=extensao)
+    os.close(fd)
+
+    linhas, colunas = 0, 0
+    writer, saida = None, None
+    concluido = False
+    try:
+        for tabela in tabelas:
+            if tabela.num_columns == 0:
+                continue
+            if formato != "Parquet":
+                tabela = _sem_dicionarios(tabela)
+            if writer is None:
+                schema = tabela.schema
+                colunas = len(schema)
+                if formato == "Parquet":
+                    writer = pq.ParquetWriter(caminho, schema)
+                else:
+                    saida = _abrir_saida(caminho, compressao)
+                    writer = pa_csv.CSVWriter(saida, schema, write_options=pa_csv.WriteOptions(quoting_style="needed"))
+            elif tabela.schema != schema:
+                tabela = tabela.select(schema.names).cast(schema)
+            writer.write_table(tabela)
+            linhas += tabela.num_rows
+        concluido = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if saida is not None:
+            saida.close()
+        if not concluido:
+            os.remove(caminho)
+    return caminho, linhas, colunas
+
+def _sem_dicionarios(tabela):
+    # O escritor CSV do Arrow nao aceita colunas categoricas
+    for i, campo in enumerate(tabela.schema):
+        if pa.types.is_dictionary(campo.type):
+            tabela = tabela.set_column(i, campo.name, tabela.column(i).cast(campo.type.value_type))
+    return tabela
+
+def _schema_df(df):
+    campos = []
+    for col in df.columns:
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col].dtype):
+            campos.append(pa.field(str(col), pa.string()))
+        else:
+            campos.append(pa.Schema.from_pandas(df[[col]].head(0), preserve_index=False).field(0))
+    return pa.schema(campos)
+
+def _lotes_df(df, posicoes=None):
+    schema = _schema_df(df)
+    if posicoes is None:
+        posicoes = np.arange(len(df))
+    for ini in range(0, len(posicoes), LINHAS_POR_LOTE):
+        lote = df.take(posicoes[ini:ini + LINHAS_POR_LOTE])
+        yield pa.Table.from_pandas(lote, schema=schema, preserve_index=False)
+
+def exportar_df(df, formato, posicoes=None):
+    return exportar_tabelas(_lotes_df(df, posicoes), formato)
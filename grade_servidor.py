@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+TAMANHO_PAGINA = 50
+COLS_BUSCA = ["Nome", "Codigo"]
+
+class GradeServidor:
+    # Ordenacao, busca e paginacao feitas em Python; o navegador recebe
+    # apenas as linhas da pagina visivel.
+
+    def __init__(self, df, indice):
+        self.df = df
+        self.n = len(df)
+        self._ordens = {}
+        self._ranks = {}
+
+        # Potencia MW reaproveita a ordem ja calculada pelo indice de filtros
+        validos = self.n - int(np.isnan(indice.potencia_ordenada).sum())
+        self._ordens[("Potencia MW", True)] = indice.ordem_potencia
+        self._ordens[("Potencia MW", False)] = np.concatenate([
+            indice.ordem_potencia[:validos][::-1],
+            indice.ordem_potencia[validos:],
+        ])
+
+    def ordem_global(self, coluna, ascendente):
+        chave = (coluna, ascendente)
+        if chave not in self._ordens:
+            serie = pd.Series(self.df[coluna].array)
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                # Os codigos seguem a ordem de chegada das categorias, nao a alfabetica
+                serie = serie.cat.set_categories(serie.cat.categories.sort_values(), ordered=True)
+            self._ordens[chave] = serie.sort_values(
+                ascending=ascendente, na_position="last", kind="stable"
+            ).index.to_numpy()
+        return self._ordens[chave]
+
+    def _rank(self, coluna, ascendente):
+        chave = (coluna, ascendente)
+        if chave not in self._ranks:
+            ordem = self.ordem_global(coluna, ascendente)
+            rank = np.empty(self.n, dtype=np.int64)
+            rank[ordem] = np.arange(self.n)
+            self._ranks[chave] = rank
+        return self._ranks[chave]
+
+    def ordenar(self, posicoes, coluna, ascendente):
+        ordem = self.ordem_global(coluna, ascendente)
+        if len(posicoes) == self.n:
+            return ordem
+        # Poucas linhas: ordena pelo rank pre-calculado. Muitas linhas:
+        # percorre a ordem global marcando as posicoes selecionadas.
+        if len(posicoes) * 16 < self.n:
+            rank = self._rank(coluna, ascendente)
+            return posicoes[np.argsort(rank[posicoes], kind="stable")]
+        mascara = np.zeros(self.n, dtype=bool)
+        mascara[posicoes] = True
+        return ordem[mascara[ordem]]
+
+    def buscar(self, posicoes, texto):
+        texto = (texto or "").strip()
+        if not texto or len(posicoes) == 0:
+            return posicoes
+        mascara = np.zeros(len(posicoes), dtype=bool)
+        for col in COLS_BUSCA:
+            if col in self.df.columns:
+                valores = pd.Series(self.df[col].array.take(posicoes)).astype("string")
+                mascara |= valores.str.contains(texto, case=False, regex=False, na=False).to_numpy(dtype=bool)
+        return posicoes[mascara]
+
+    def pagina(self, posicoes_ordenadas, pagina, tamanho=TAMANHO_PAGINA):
+        ini = max(pagina - 1, 0) * tamanho
+        return self.df.take(posicoes_ordenadas[ini:ini + tamanho])
+
+def total_paginas(total, tamanho=TAMANHO_PAGINA):
+    return max((total + tamanho - 1) // tamanho, 1)
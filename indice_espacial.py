@@ -0,0 +1,107 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+RAIO_TERRA_KM = 6371.0088
+KM_POR_GRAU = np.pi * RAIO_TERRA_KM / 180
+
+# Lado da celula da grade (graus): ~11 km no equador
+TAMANHO_CELULA = 0.1
+
+def distancia_km(lat, lon, lats, lons):
+    # Haversine de um ponto para varios
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2 = np.radians(lats.astype("float64"))
+    lon2 = np.radians(lons.astype("float64"))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class IndiceEspacial:
+    # Grade regular sobre Lat/Lon construida uma vez por base. As posicoes
+    # ficam ordenadas por celula, entao cada linha de celulas de uma consulta
+    # e uma fatia continua; a distancia exata so e calculada nos candidatos.
+
+    def __init__(self, df, tamanho=TAMANHO_CELULA):
+        self.n = len(df)
+        self.tamanho = tamanho
+        self.lat = df["Lat"].to_numpy(dtype="float32")
+        self.lon = df["Lon"].to_numpy(dtype="float32")
+        # Codigos em Arrow, para usar uma instalacao como centro da busca
+        self.codigos = None
+        if "Codigo" in df.columns:
+            self.codigos = pa.array(df["Codigo"].astype(str).to_numpy(dtype=object), type=pa.string())
+        if self.n == 0:
+            self.iy0 = self.ix0 = 0
+            self.altura = self.largura = 1
+            self.ordem = np.empty(0, dtype=np.int64)
+            self.inicio = np.zeros(2, dtype=np.int64)
+            return
+
+        iy = np.floor(self.lat / tamanho).astype(np.int64)
+        ix = np.floor(self.lon / tamanho).astype(np.int64)
+        self.iy0, self.ix0 = int(iy.min()), int(ix.min())
+        self.altura = int(iy.max()) - self.iy0 + 1
+        self.largura = int(ix.max()) - self.ix0 + 1
+
+        chave = (iy - self.iy0) * self.largura + (ix - self.ix0)
+        self.ordem = np.argsort(chave, kind="stable").astype(np.int64)
+        # inicio[c]:inicio[c + 1] sao as posicoes (em ordem) da celula c
+        self.inicio = np.searchsorted(chave[self.ordem], np.arange(self.altura * self.largura + 1))
+
+    def posicao(self, codigo):
+        # Primeira posicao com o codigo, ou None. A busca linear do Arrow leva
+        # poucos ms mesmo com milhoes de linhas.
+        if self.codigos is None:
+            return None
+        pos = pc.index(self.codigos, codigo).as_py()
+        return pos if pos >= 0 else None
+
+    def _candidatos(self, lat, lon, raio_km):
+        if self.n == 0:
+            return np.empty(0, dtype=np.int64)
+        dlat = raio_km / KM_POR_GRAU
+        # Um grau de longitude e mais curto na latitude mais longe do equador;
+        # la o raio cobre mais graus, entao dlon e calculado nessa latitude
+        lat_extrema = min(abs(lat) + dlat, 89.9)
+        dlon = min(raio_km / (KM_POR_GRAU * np.cos(np.radians(lat_extrema))), 180.0)
+
+        y0 = max(int(np.floor((lat - dlat) / self.tamanho)) - self.iy0, 0)
+        y1 = min(int(np.floor((lat + dlat) / self.tamanho)) - self.iy0, self.altura - 1)
+        x0 = max(int(np.floor((lon - dlon) / self.tamanho)) - self.ix0, 0)
+        x1 = min(int(np.floor((lon + dlon) / self.tamanho)) - self.ix0, self.largura - 1)
+        if y0 > y1 or x0 > x1:
+            return np.empty(0, dtype=np.int64)
+
+        linhas = np.arange(y0, y1 + 1) * self.largura
+        inicios = self.inicio[linhas + x0]
+        fins = self.inicio[linhas + x1 + 1]
+        partes = [self.ordem[a:b] for a, b in zip(inicios, fins) if b > a]
+        return np.concatenate(partes) if partes else np.empty(0, dtype=np.int64)
+
+    def raio(self, lat, lon, raio_km, permitidas=None):
+        # Posicoes (ordenadas) a ate raio_km do ponto e as respectivas distancias.
+        # permitidas: mascara booleana opcional com as linhas elegiveis.
+        pos = self._candidatos(lat, lon, raio_km)
+        if permitidas is not None:
+            pos = pos[permitidas[pos]]
+        dist = distancia_km(lat, lon, self.lat[pos], self.lon[pos])
+        dentro = dist <= raio_km
+        pos, dist = pos[dentro], dist[dentro]
+        ordem = np.argsort(pos)
+        return pos[ordem], dist[ordem]
+
+    def proximas(self, lat, lon, k, permitidas=None):
+        # As k posicoes mais proximas, da mais perto para a mais longe. A
+        # busca comeca em algumas celulas e dobra o raio ate achar k pontos.
+        total = self.n if permitidas is None else int(permitidas.sum())
+        k = min(k, total)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        raio_km = self.tamanho * KM_POR_GRAU
+        while True:
+            pos, dist = self.raio(lat, lon, raio_km, permitidas)
+            if len(pos) >= k or raio_km > np.pi * RAIO_TERRA_KM:
+                break
+            raio_km *= 2
+        ordem = np.argsort(dist, kind="stable")[:k]
+        return pos[ordem], dist[ordem]
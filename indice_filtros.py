@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+DIMENSOES = ("Categoria", "Fonte", "UF")
+
+class IndiceFiltros:
+    # Construido uma vez por base carregada. Cada filtro devolve posicoes de
+    # linha (ordenadas) em vez de copias do DataFrame.
+
+    def __init__(self, df):
+        self.n = len(df)
+        self.codigos = {}
+        self.categorias = {}
+        self.posicoes = {}
+
+        for dim in DIMENSOES:
+            serie = df[dim]
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                serie = serie.astype("category")
+            codigos = serie.cat.codes.to_numpy()
+            categorias = list(serie.cat.categories)
+
+            # Posicoes agrupadas por codigo; dentro do grupo seguem em ordem
+            ordem = np.argsort(codigos, kind="stable").astype(np.int64)
+            limites = np.searchsorted(codigos[ordem], np.arange(len(categorias) + 1))
+            self.codigos[dim] = codigos
+            self.categorias[dim] = categorias
+            self.posicoes[dim] = {
+                valor: ordem[limites[i]:limites[i + 1]]
+                for i, valor in enumerate(categorias)
+                if limites[i + 1] > limites[i]
+            }
+
+        self.potencia = df["Potencia MW"].to_numpy(dtype="float32", na_value=np.nan)
+        # NaN vai para o fim e nunca entra em um intervalo
+        self.ordem_potencia = np.argsort(self.potencia, kind="stable").astype(np.int64)
+        self.potencia_ordenada = self.potencia[self.ordem_potencia]
+
+    def valores(self, dim):
+        return sorted(self.posicoes[dim].keys())
+
+    def _intervalo_potencia(self, pot_min, pot_max):
+        ini = 0 if pot_min is None else np.searchsorted(self.potencia_ordenada, pot_min, side="left")
+        if pot_max is None:
+            fim = self.n - int(np.isnan(self.potencia_ordenada).sum())
+        else:
+            fim = np.searchsorted(self.potencia_ordenada, pot_max, side="right")
+        return int(ini), int(fim)
+
+    def selecionar(self, categorias=None, fontes=None, ufs=None, pot_min=None, pot_max=None):
+        filtros = [
+            (dim, valores)
+            for dim, valores in (("Categoria", categorias), ("Fonte", fontes), ("UF", ufs))
+            if valores
+        ]
+        usa_potencia = pot_min is not None or pot_max is not None
+
+        # O menor conjunto candidato e materializado; os demais filtros sao
+        # verificados apenas nessas posicoes, entao o custo acompanha o resultado.
+        candidatos = []
+        for dim, valores in filtros:
+            tamanho = sum(len(self.posicoes[dim].get(v, ())) for v in valores)
+            candidatos.append((tamanho, dim, valores))
+        if usa_potencia:
+            ini, fim = self._intervalo_potencia(pot_min, pot_max)
+            candidatos.append((max(fim - ini, 0), "Potencia MW", (ini, fim)))
+
+        if not candidatos:
+            return np.arange(self.n, dtype=np.int64)
+
+        candidatos.sort(key=lambda c: c[0])
+        _, dim, valores = candidatos[0]
+        if dim == "Potencia MW":
+            ini, fim = valores
+            pos = np.sort(self.ordem_potencia[ini:max(fim, ini)])
+        else:
+            partes = [self.posicoes[dim][v] for v in valores if v in self.posicoes[dim]]
+            pos = np.sort(np.concatenate(partes)) if partes else np.empty(0, dtype=np.int64)
+
+        for _, dim, valores in candidatos[1:]:
+            if len(pos) == 0:
+                break
+            if dim == "Potencia MW":
+                pot = self.potencia[pos]
+                mascara = np.ones(len(pos), dtype=bool)
+                if pot_min is not None:
+                    mascara &= pot >= pot_min
+                if pot_max is not None:
+                    mascara &= pot <= pot_max
+                else:
+                    mascara &= ~np.isnan(pot)
+            else:
+                valores = set(valores)
+                selecionados = [i for i, c in enumerate(self.categorias[dim]) if c in valores]
+                mascara = np.isin(self.codigos[dim][pos], selecionados)
+            pos = pos[mascara]
+        return pos
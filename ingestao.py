@@ -0,0 +1,430 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import cliente_aneel
+import metricas
+import snapshot
+from checkpoint import limpar_checkpoints
+from cliente_aneel import (
+    ESTADOS_BR, MAX_DOWNLOADS_PARALELOS, NOMES_RECURSOS, PROJECOES, RES_GD_INFO, RES_USINAS, UF_COLUNAS,
+    DownloadIncompleto, baixar_base_bruta, baixar_gd_foto_nacional, buscar_tecnicos_por_codigos,
+)
+from dados_tecnicos import CHAVE_LOOKUP, carregar_lookup, deduplicar, gravar_lookup, tecnicos_para
+from diferencas import MUDANCAS, codigos_normalizados, comparar, hashes_por_codigo, montar_feed
+from normalizacao import CATEGORIA_GD, CATEGORIA_USINA, limpar_codigo, normalizar_gd, normalizar_usinas, unificar
+from snapshot import (
+    atualizar_em_segundo_plano, gravar_snapshot, ler_manifesto, ler_snapshot, obter_snapshot,
+    resultado_completo, snapshot_expirado,
+)
+
+# Pipeline de carga sem interface: o dashboard e o comando
+# "python -m ingestao" usam as mesmas funcoes.
+
+RECURSOS_POR_NOME = {nome: res for res, nome in NOMES_RECURSOS.items()}
+RECURSOS_POR_UF = (RES_USINAS, RES_GD_INFO)
+# Codigo da instalacao na base bruta e categoria correspondente na normalizada
+COLUNAS_CODIGO = {RES_USINAS: "CodCEG", RES_GD_INFO: "CodEmpreendimento"}
+CATEGORIAS = {RES_USINAS: CATEGORIA_USINA, RES_GD_INFO: CATEGORIA_GD}
+
+# Processos que normalizam UFs em paralelo; 1 mantem tudo no processo atual.
+# Abaixo de MIN_REGISTROS_PARALELO linhas brutas, iniciar os processos custa
+# mais do que normalizar tudo aqui.
+PROCESSOS_NORMALIZACAO = int(os.environ.get("ANEEL_PROCESSOS_NORMALIZACAO", "0")) or os.cpu_count() or 1
+MIN_REGISTROS_PARALELO = int(os.environ.get("ANEEL_MIN_REGISTROS_PARALELO", "200000"))
+
+# =====================================================
+# SHARDS BRUTOS POR RECURSO E UF
+# =====================================================
+
+def chave_shard(resource_id, uf):
+    return NOMES_RECURSOS[resource_id] + "_" + (uf or "todos")
+
+def baixar_shard(resource_id, uf):
+    fields, filters = PROJECOES[resource_id]
+    ufs = [uf] if uf else ESTADOS_BR
+    return baixar_base_bruta(ufs, resource_id, UF_COLUNAS[resource_id], fields=fields, filters=filters)
+
+def carregar_shard(resource_id, uf):
+    # Um shard por recurso e UF; GD Foto fica no lookup de dados_tecnicos
+    with metricas.cronometro("shard_" + NOMES_RECURSOS[resource_id]) as info:
+        df = obter_snapshot(chave_shard(resource_id, uf), lambda: baixar_shard(resource_id, uf))
+        info["registros"] = len(df)
+    return df
+
+def shards_da_selecao(ufs):
+    return [(res, uf) for uf in ufs for res in RECURSOS_POR_UF]
+
+def pre_carregar_shards(ufs):
+    # Baixa em paralelo so os shards que ainda nao existem em disco. Devolve
+    # {chave: erro} dos que nao foram gravados, para quem chama nao baixar
+    # de novo, um a um, o que acabou de falhar.
+    falhas = {}
+    faltando = [s for s in shards_da_selecao(ufs) if ler_manifesto(chave_shard(*s)) is None]
+    if not faltando:
+        return falhas
+    with metricas.cronometro("pre_carregar_shards"), ThreadPoolExecutor(max_workers=min(len(faltando), MAX_DOWNLOADS_PARALELOS)) as ex:
+        futures = {ex.submit(carregar_shard, res, uf): (res, uf) for res, uf in faltando}
+        for fut in as_completed(futures):
+            res, uf = futures[fut]
+            chave = chave_shard(res, uf)
+            try:
+                fut.result()
+            except Exception as e:
+                print("Erro carregando shard " + chave + ": " + str(e))
+                falhas[chave] = e if isinstance(e, DownloadIncompleto) else DownloadIncompleto(chave, 0, None, str(e))
+                continue
+            if ler_manifesto(chave) is None:
+                falhas[chave] = DownloadIncompleto(chave, 0, None, "resultado vazio sem total confirmado")
+    return falhas
+
+def _atualizar_shards_vencidos(uf):
+    for res in RECURSOS_POR_UF:
+        manifesto = ler_manifesto(chave_shard(res, uf))
+        if manifesto is not None and snapshot_expirado(manifesto):
+            atualizar_em_segundo_plano(chave_shard(res, uf), lambda res=res: baixar_shard(res, uf))
+
+def tecnicos_da_selecao(df_gd):
+    if df_gd.empty or "CodEmpreendimento" not in df_gd.columns:
+        return pd.DataFrame()
+    with metricas.cronometro("tecnicos_gd_foto") as info:
+        df_tech = tecnicos_para(df_gd["CodEmpreendimento"], buscar_tecnicos_por_codigos, baixar_gd_foto_nacional)
+        info["registros"] = len(df_tech)
+    return df_tech
+
+# =====================================================
+# SHARDS NORMALIZADOS
+# =====================================================
+
+def chave_normalizado(uf):
+    return "normalizado_" + uf
+
+def chave_hashes(uf):
+    return "hashes_" + uf
+
+def chave_mudancas(uf):
+    return "mudancas_" + uf
+
+def normalizar_recurso(res, df_raw):
+    if df_raw.empty:
+        return pd.DataFrame()
+    if res == RES_USINAS:
+        with metricas.cronometro("normalizar_usinas") as info:
+            info["registros"] = len(df_raw)
+            return normalizar_usinas(df_raw)
+    df_tech = tecnicos_da_selecao(df_raw)
+    with metricas.cronometro("normalizar_gd") as info:
+        info["registros"] = len(df_raw)
+        return normalizar_gd(df_raw, df_tech)
+
+def _tabela_hashes(hashes):
+    return pd.concat(
+        [h.assign(Recurso=NOMES_RECURSOS[res]) for res, h in hashes.items()], ignore_index=True
+    )[["Recurso", "Codigo", "Hash"]]
+
+def atualizar_normalizado(anterior, hashes_anteriores, brutos, hashes):
+    # Aplica ao snapshot normalizado anterior so as diferencas entre as
+    # versoes dos shards brutos: codigos removidos ou alterados saem, e so os
+    # adicionados ou alterados passam pela normalizacao (e pelo GD Foto).
+    # Devolve a base atualizada, as linhas novas e as removidas (para o feed),
+    # os codigos adicionados e a contagem por tipo de mudanca.
+    codigos_ant = codigos_normalizados(anterior)
+    categorias_ant = anterior["Categoria"].astype(object).to_numpy()
+    sai = np.zeros(len(anterior), dtype=bool)
+    removidas = np.zeros(len(anterior), dtype=bool)
+    novos, adicionados_todos, mudados = [], [], []
+    contagem = dict.fromkeys(MUDANCAS, 0)
+
+    for res in RECURSOS_POR_UF:
+        antigos = hashes_anteriores[hashes_anteriores["Recurso"] == NOMES_RECURSOS[res]]
+        adicionados, alterados, removidos = comparar(antigos[["Codigo", "Hash"]], hashes[res])
+        contagem["adicionado"] += len(adicionados)
+        contagem["alterado"] += len(alterados)
+        contagem["removido"] += len(removidos)
+        adicionados_todos.append(adicionados)
+        mudados.append(np.concatenate([adicionados, alterados]))
+        recalcular = mudados[-1]
+
+        da_categoria = categorias_ant == CATEGORIAS[res]
+        if res == RES_GD_INFO:
+            # Codigos sem dados tecnicos no lookup (ex.: lote do GD Foto que
+            # falhou) sao refeitos, como aconteceria numa normalizacao completa
+            lookup = carregar_lookup()
+            if not lookup.completo:
+                pendentes = lookup.faltando(np.unique(codigos_ant[da_categoria]))
+                recalcular = np.union1d(recalcular, np.setdiff1d(pendentes, removidos))
+        sai |= da_categoria & np.isin(codigos_ant, np.concatenate([recalcular, removidos]))
+        removidas |= da_categoria & np.isin(codigos_ant, removidos)
+
+        bruto = brutos[res]
+        if len(recalcular) and not bruto.empty:
+            codigos = limpar_codigo(bruto[COLUNAS_CODIGO[res]]).fillna("").to_numpy(dtype=object)
+            novos.append(normalizar_recurso(res, bruto[np.isin(codigos, recalcular)].reset_index(drop=True)))
+
+    df_novos = unificar(novos)
+    df = unificar([anterior[~sai].reset_index(drop=True), df_novos])
+    if len(df_novos):
+        df_novos = df_novos[np.isin(codigos_normalizados(df_novos), np.concatenate(mudados))].reset_index(drop=True)
+    return df, df_novos, anterior[removidas].reset_index(drop=True), np.concatenate(adicionados_todos), contagem
+
+def _lookup_renovado_depois(manifesto):
+    # Lookup nacional regravado depois do snapshot: fabricantes podem ter mudado
+    lookup = ler_manifesto(CHAVE_LOOKUP)
+    return lookup is not None and lookup.get("completo") and lookup["gerado_em"] > manifesto["gerado_em"]
+
+def renormalizar_uf(uf):
+    # Atualiza o snapshot normalizado a partir dos shards brutos atuais,
+    # de forma incremental quando ha uma versao anterior com hashes
+    brutos = {res: carregar_shard(res, uf) for res in RECURSOS_POR_UF}
+    with metricas.cronometro("hashes_brutos") as info:
+        hashes = {res: hashes_por_codigo(brutos[res], COLUNAS_CODIGO[res]) for res in RECURSOS_POR_UF}
+        info["registros"] = sum(len(b) for b in brutos.values())
+
+    anterior, manifesto = ler_snapshot(chave_normalizado(uf))
+    hashes_anteriores, _ = ler_snapshot(chave_hashes(uf))
+    completos = all(ler_manifesto(chave_shard(res, uf)) is not None for res in RECURSOS_POR_UF)
+
+    if anterior is None or hashes_anteriores is None or _lookup_renovado_depois(manifesto):
+        df = unificar([normalizar_recurso(res, brutos[res]) for res in RECURSOS_POR_UF])
+        if completos:
+            gravar_snapshot(chave_normalizado(uf), df, extras={"incremental": False})
+            gravar_snapshot(chave_hashes(uf), _tabela_hashes(hashes))
+        return df
+
+    with metricas.cronometro("normalizar_incremental") as info:
+        df, df_novos, df_removidos, adicionados, contagem = atualizar_normalizado(
+            anterior, hashes_anteriores, brutos, hashes
+        )
+        info["registros"] = len(df_novos) + len(df_removidos)
+    if completos:
+        agora = time.strftime("%Y-%m-%dT%H:%M:%S")
+        gravar_snapshot(chave_mudancas(uf), montar_feed(df_novos, df_removidos, adicionados, agora), extras=contagem)
+        gravar_snapshot(chave_normalizado(uf), df, extras={"incremental": True, "mudancas": contagem})
+        gravar_snapshot(chave_hashes(uf), _tabela_hashes(hashes))
+    return df
+
+def normalizado_em_dia(uf):
+    # O snapshot normalizado vale enquanto for mais novo que os shards brutos
+    manifesto = ler_manifesto(chave_normalizado(uf))
+    brutos = [ler_manifesto(chave_shard(res, uf)) for res in RECURSOS_POR_UF]
+    return manifesto is not None and all(b is not None and b["gerado_em"] <= manifesto["gerado_em"] for b in brutos)
+
+def carregar_uf_normalizado(uf):
+    if normalizado_em_dia(uf):
+        with metricas.cronometro("ler_normalizado") as info:
+            df, _ = ler_snapshot(chave_normalizado(uf))
+            info["registros"] = 0 if df is None else len(df)
+        if df is not None:
+            _atualizar_shards_vencidos(uf)
+            return df
+    return renormalizar_uf(uf)
+
+def mudancas(ufs):
+    # Feed de mudancas da ultima atualizacao de cada UF, com a contagem por tipo
+    partes, contagem = [], dict.fromkeys(MUDANCAS, 0)
+    for uf in ufs:
+        df, manifesto = ler_snapshot(chave_mudancas(uf))
+        if df is None:
+            continue
+        partes.append(df)
+        for m in MUDANCAS:
+            contagem[m] += manifesto.get(m, 0)
+    if not partes:
+        return pd.DataFrame(), contagem
+    return pd.concat(partes, ignore_index=True), contagem
+
+def _iniciar_processo(cache_dir, base_url):
+    # Processos novos (spawn) nao herdam configuracoes alteradas em tempo de execucao
+    snapshot.CACHE_DIR = cache_dir
+    cliente_aneel.BASE_URL = base_url
+
+def _renormalizar_em_processo(uf):
+    metricas.limpar()
+    df = renormalizar_uf(uf)
+    return df, [e for e in metricas.resumo()["eventos"] if e["tipo"] == "etapa"]
+
+def normalizar_ufs(ufs, processos=None, min_registros=None):
+    # Renormaliza varias UFs em paralelo, uma por processo, com o mesmo
+    # renormalizar_uf do caminho serial. Devolve {uf: df} das UFs que deram
+    # certo; quem chama refaz as demais no processo atual (e ve o erro).
+    # So entram UFs com todos os shards brutos em disco: um shard que falhou
+    # seria baixado de novo aqui, fora do tratamento de erro por UF.
+    ufs = [uf for uf in ufs if all(ler_manifesto(chave_shard(res, uf)) is not None for res in RECURSOS_POR_UF)]
+    processos = min(processos or PROCESSOS_NORMALIZACAO, len(ufs))
+    min_registros = MIN_REGISTROS_PARALELO if min_registros is None else min_registros
+    registros = sum(
+        (ler_manifesto(chave_shard(res, uf)) or {}).get("registros", 0) for uf in ufs for res in RECURSOS_POR_UF
+    )
+    if processos <= 1 or registros < min_registros:
+        return {}
+
+    # O lookup do GD Foto e compartilhado: os codigos de todas as UFs sao
+    # resolvidos aqui, uma vez, e os processos so o leem
+    try:
+        tecnicos_da_selecao(pd.concat([carregar_shard(RES_GD_INFO, uf) for uf in ufs], ignore_index=True))
+    except Exception as e:
+        print("Erro preparando a normalizacao em paralelo: " + str(e))
+        return {}
+
+    prontos = {}
+    contexto = multiprocessing.get_context("spawn")
+    with metricas.cronometro("normalizar_paralelo") as info, ProcessPoolExecutor(
+        max_workers=processos, mp_context=contexto,
+        initializer=_iniciar_processo, initargs=(snapshot.CACHE_DIR, cliente_aneel.BASE_URL),
+    ) as ex:
+        futures = {ex.submit(_renormalizar_em_processo, uf): uf for uf in ufs}
+        for fut in as_completed(futures):
+            uf = futures[fut]
+            try:
+                df, etapas = fut.result()
+            except Exception as e:
+                print("Erro normalizando " + uf + " em paralelo: " + str(e))
+                continue
+            # Etapas medidas no processo filho entram nas metricas deste processo
+            for etapa in etapas:
+                metricas.registrar_etapa(etapa["nome"], etapa["segundos"], etapa["registros"])
+            prontos[uf] = df
+        info["registros"] = sum(len(df) for df in prontos.values())
+    return prontos
+
+def snapshots_prontos(ufs):
+    return all(ler_manifesto(chave_normalizado(uf)) is not None for uf in ufs)
+
+def carregar_dados_unificados(ufs_tuple, carregar_uf=None, processos=None):
+    carregar_uf = carregar_uf or carregar_uf_normalizado
+    falhas = pre_carregar_shards(ufs_tuple)
+    if falhas:
+        raise next(iter(falhas.values()))
+    prontos = normalizar_ufs([uf for uf in ufs_tuple if not normalizado_em_dia(uf)], processos)
+    partes = [prontos[uf] if uf in prontos else carregar_uf(uf) for uf in ufs_tuple]
+    with metricas.cronometro("unificar") as info:
+        df_final = unificar(partes)
+        info["registros"] = len(df_final)
+    df_final.attrs["versao"] = versao_normalizada(ufs_tuple)
+    return df_final
+
+def versao_normalizada(ufs):
+    # Muda so quando algum snapshot normalizado e regravado, entao recarregar
+    # a mesma base (ex.: fim do TTL em memoria) mantem a mesma versao
+    versao = []
+    for uf in ufs:
+        manifesto = ler_manifesto(chave_normalizado(uf))
+        versao.append(manifesto["gerado_em"] if manifesto is not None else time.time())
+    return tuple(versao)
+
+# =====================================================
+# EXECUCAO AGENDADA (cron)
+# =====================================================
+
+def ingerir(ufs, recursos, forcar=False, processos=None):
+    # Atualiza os shards brutos pedidos (vencidos ou todos, com forcar) e
+    # regrava os snapshots normalizados. Devolve a lista de falhas.
+    falhas = []
+    pendentes = []
+    for uf in ufs:
+        for res in RECURSOS_POR_UF:
+            if NOMES_RECURSOS[res] not in recursos:
+                continue
+            manifesto = ler_manifesto(chave_shard(res, uf))
+            if forcar or manifesto is None or snapshot_expirado(manifesto):
+                pendentes.append((res, uf))
+
+    with ThreadPoolExecutor(max_workers=max(min(len(pendentes), MAX_DOWNLOADS_PARALELOS), 1)) as ex:
+        futures = {ex.submit(baixar_shard, res, uf): (res, uf) for res, uf in pendentes}
+        for fut in as_completed(futures):
+            res, uf = futures[fut]
+            chave = chave_shard(res, uf)
+            try:
+                df = fut.result()
+            except Exception as e:
+                df = None
+                print("Erro " + chave + ": " + str(e))
+            if df is None or not resultado_completo(df):
+                falhas.append(chave)
+                print(chave + ": falhou")
+                continue
+            gravar_snapshot(chave, df)
+            print(chave + ": " + str(len(df)) + " registros")
+
+    if "gd_foto" in recursos:
+        try:
+            df_foto = deduplicar(baixar_gd_foto_nacional())
+        except Exception as e:
+            df_foto = None
+            print("Erro gd_foto: " + str(e))
+        if df_foto is None or df_foto.empty:
+            falhas.append("gd_foto")
+            print("gd_foto: falhou")
+        else:
+            gravar_lookup(df_foto, True)
+            print("gd_foto: " + str(len(df_foto)) + " codigos")
+
+    # UF com shard que falhou agora e sem copia anterior em disco fica de fora:
+    # normalizar baixaria de novo o que acabou de falhar
+    normalizar = []
+    for uf in ufs:
+        perdidos = [chave_shard(res, uf) for res in RECURSOS_POR_UF
+                    if chave_shard(res, uf) in falhas and ler_manifesto(chave_shard(res, uf)) is None]
+        if perdidos:
+            falhas.append(chave_normalizado(uf))
+            print(chave_normalizado(uf) + ": ignorado, sem " + ", ".join(perdidos))
+        else:
+            normalizar.append(uf)
+
+    prontos = normalizar_ufs([uf for uf in normalizar if not normalizado_em_dia(uf)], processos)
+    for uf in normalizar:
+        try:
+            df = prontos[uf] if uf in prontos else carregar_uf_normalizado(uf)
+        except Exception as e:
+            falhas.append(chave_normalizado(uf))
+            print("Erro " + chave_normalizado(uf) + ": " + str(e))
+            continue
+        manifesto = ler_manifesto(chave_normalizado(uf)) or {}
+        mudou = manifesto.get("mudancas")
+        print(chave_normalizado(uf) + ": " + str(len(df)) + " instalacoes" + (
+            " (+" + str(mudou["adicionado"]) + " ~" + str(mudou["alterado"]) + " -" + str(mudou["removido"]) + ")"
+            if mudou else ""
+        ))
+    return falhas
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m ingestao",
+        description="Baixa os dados da ANEEL e grava snapshots prontos para o dashboard.",
+    )
+    parser.add_argument("--ufs", nargs="+", default=ESTADOS_BR, metavar="UF",
+                        help="estados a atualizar (padrao: todos)")
+    parser.add_argument("--recursos", nargs="+", default=["usinas", "gd_info"],
+                        choices=sorted(RECURSOS_POR_NOME),
+                        help="bases a atualizar; gd_foto reconstroi o lookup tecnico nacional")
+    parser.add_argument("--forcar", action="store_true",
+                        help="baixa de novo mesmo os snapshots que ainda estao no prazo")
+    parser.add_argument("--processos", type=int, default=None,
+                        help="processos para normalizar UFs em paralelo (padrao: ANEEL_PROCESSOS_NORMALIZACAO ou numero de CPUs)")
+    parser.add_argument("--metricas", metavar="JSON",
+                        help="grava o resumo de metricas da execucao neste arquivo")
+    args = parser.parse_args(argv)
+
+    ufs = sorted(set(uf.upper() for uf in args.ufs))
+    invalidas = [uf for uf in ufs if uf not in ESTADOS_BR]
+    if invalidas:
+        parser.error("UF invalida: " + ", ".join(invalidas))
+
+    inicio = time.time()
+    limpar_checkpoints()
+    falhas = ingerir(ufs, set(args.recursos), forcar=args.forcar, processos=args.processos)
+    if args.metricas:
+        with open(args.metricas, "w", encoding="utf-8") as f:
+            json.dump(metricas.resumo(), f, ensure_ascii=False, indent=2)
+    print("Concluido em " + str(round(time.time() - inicio, 1)) + " s, " + str(len(falhas)) + " falha(s)")
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+# Acima deste numero de pontos o mapa recebe celulas agregadas
+LIMITE_PONTOS = 3000
+
+# Lado da celula (graus) para cada nivel de zoom do mapa
+TAMANHO_CELULA_POR_ZOOM = {
+    4: 0.5,
+    5: 0.25,
+    6: 0.1,
+}
+
+COLS_PONTOS = ["Nome", "Categoria", "UF", "Fonte", "Potencia MW", "Lat", "Lon"]
+
+def zoom_para_ufs(ufs):
+    if len(ufs) == 1:
+        return 6
+    if len(ufs) <= 5:
+        return 5
+    return 4
+
+def zoom_para_raio(raio_km):
+    # Zoom em que um circulo com este raio cabe na tela
+    for zoom, limite in ((10, 5), (9, 12), (8, 25), (7, 60), (6, 150), (5, 400)):
+        if raio_km <= limite:
+            return zoom
+    return 4
+
+def tamanho_celula(zoom):
+    niveis = sorted(TAMANHO_CELULA_POR_ZOOM)
+    nivel = max([z for z in niveis if z <= zoom], default=niveis[0])
+    return TAMANHO_CELULA_POR_ZOOM[nivel]
+
+def agregar_celulas(lat, lon, potencia, fonte_codigos, fonte_categorias, tamanho):
+    # Agrupa pontos em celulas de grade com contagem, MW somado e a fonte
+    # dominante, tudo com operacoes NumPy sobre os arrays ja filtrados.
+    colunas = ["Lat", "Lon", "Instalacoes", "Potencia MW", "Fonte"]
+    if len(lat) == 0:
+        return pd.DataFrame(columns=colunas)
+
+    iy = np.floor(lat / tamanho).astype(np.int64)
+    ix = np.floor(lon / tamanho).astype(np.int64)
+    largura = int(ix.max() - ix.min()) + 1
+    chave = (iy - iy.min()) * largura + (ix - ix.min())
+    celulas, inverso = np.unique(chave, return_inverse=True)
+
+    contagem = np.bincount(inverso)
+    soma_mw = np.bincount(inverso, weights=np.nan_to_num(potencia.astype("float64")))
+
+    # Fonte dominante: conta pares (celula, fonte) e fica com o maior por celula
+    n_fontes = len(fonte_categorias) + 1
+    pares, qtd = np.unique(inverso * n_fontes + (fonte_codigos.astype(np.int64) + 1), return_counts=True)
+    celula_par = pares // n_fontes
+    ordem = np.lexsort((-qtd, celula_par))
+    primeiros = np.r_[True, celula_par[ordem][1:] != celula_par[ordem][:-1]]
+    dominante = (pares[ordem][primeiros] % n_fontes) - 1
+    nomes_fontes = np.array(list(fonte_categorias) + ["-"], dtype=object)
+
+    cel_y = celulas // largura + iy.min()
+    cel_x = celulas % largura + ix.min()
+    return pd.DataFrame({
+        "Lat":         (cel_y + 0.5) * tamanho,
+        "Lon":         (cel_x + 0.5) * tamanho,
+        "Instalacoes": contagem,
+        "Potencia MW": np.round(soma_mw, 2),
+        "Fonte":       nomes_fontes[dominante],
+    }, columns=colunas)
+
+def pontos_mapa(df, posicoes):
+    pontos = df[COLS_PONTOS].take(posicoes)
+    pontos["map_radius"] = np.maximum(pontos["Potencia MW"].to_numpy(dtype="float64") * 500, 2000)
+    return pontos
@@ -0,0 +1,219 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metricas do processo inteiro (todas as sessoes do Streamlit e o comando de
+# ingestao): requisicoes a API, etapas do pipeline, caches e tamanho dos
+# payloads enviados ao navegador. Opcionalmente cada evento vai para um log
+# JSON (uma linha por evento) e o resumo fica disponivel por HTTP.
+
+ARQUIVO_LOG   = os.environ.get("ANEEL_METRICAS_LOG")
+PORTA_HTTP    = int(os.environ.get("ANEEL_METRICAS_PORTA", "0"))
+HOST_HTTP     = os.environ.get("ANEEL_METRICAS_HOST", "127.0.0.1")
+MAX_EVENTOS   = 200
+
+_lock = threading.Lock()
+_local = threading.local()
+_requisicoes = {}
+_etapas = {}
+_caches = {}
+_tamanhos = {}
+_controle = {}
+_eventos = deque(maxlen=MAX_EVENTOS)
+_servidor = {"http": None}
+
+def _log(evento):
+    evento = dict(evento, ts=round(time.time(), 3))
+    with _lock:
+        _eventos.append(evento)
+        if ARQUIVO_LOG:
+            try:
+                with open(ARQUIVO_LOG, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print("Erro gravando log de metricas: " + str(e))
+
+def _acumular(tabela, nome, campos):
+    with _lock:
+        atual = tabela.setdefault(nome, {})
+        for campo, valor in campos.items():
+            atual[campo] = atual.get(campo, 0) + valor
+        return atual
+
+# =====================================================
+# REGISTRO
+# =====================================================
+
+def registrar_requisicao(recurso, offset, segundos, espera, parse, n_bytes, registros, retentativas):
+    atual = _acumular(_requisicoes, recurso, {
+        "requisicoes": 1, "segundos": segundos, "espera_s": espera, "parse_s": parse,
+        "bytes": n_bytes, "registros": registros, "retentativas": retentativas,
+    })
+    with _lock:
+        atual["max_s"] = max(atual.get("max_s", 0.0), segundos)
+    _log({"tipo": "requisicao", "recurso": recurso, "offset": offset, "segundos": round(segundos, 4),
+          "espera_s": round(espera, 4), "parse_s": round(parse, 4), "bytes": n_bytes,
+          "registros": registros, "retentativas": retentativas})
+
+def registrar_erro(recurso, offset, mensagem):
+    _acumular(_requisicoes, recurso, {"erros": 1})
+    _log({"tipo": "erro", "recurso": recurso, "offset": offset, "mensagem": mensagem})
+
+def registrar_sobrecarga(recurso, offset, motivo):
+    # Resposta 429/5xx ou timeout: a requisicao volta para a fila
+    _acumular(_requisicoes, recurso, {"sobrecargas": 1})
+    _log({"tipo": "sobrecarga", "recurso": recurso, "offset": offset, "motivo": motivo})
+
+def registrar_controle(estado):
+    # Ultimo estado do controle de vazao (concorrencia e tamanho de pagina)
+    with _lock:
+        _controle.clear()
+        _controle.update(estado)
+
+def registrar_interrupcao(recurso, offset, recebidos, total, motivo):
+    # Download encerrado antes de receber o total anunciado pela API
+    _acumular(_requisicoes, recurso, {"interrupcoes": 1})
+    _log({"tipo": "interrupcao", "recurso": recurso, "offset": offset, "recebidos": recebidos,
+          "total": total, "motivo": motivo})
+
+def registrar_retomada(recurso, paginas):
+    # Download retomado a partir de paginas salvas numa tentativa anterior
+    _acumular(_requisicoes, recurso, {"paginas_retomadas": paginas})
+    _log({"tipo": "retomada", "recurso": recurso, "paginas": paginas})
+
+def registrar_etapa(nome, segundos, registros=None):
+    campos = {"execucoes": 1, "segundos": segundos}
+    if registros is not None:
+        campos["registros"] = registros
+    atual = _acumular(_etapas, nome, campos)
+    with _lock:
+        atual["ultimo_s"] = segundos
+        atual["max_s"] = max(atual.get("max_s", 0.0), segundos)
+    _log({"tipo": "etapa", "nome": nome, "segundos": round(segundos, 4), "registros": registros})
+
+@contextmanager
+def cronometro(nome):
+    # Quem usa pode preencher info["registros"] para calcular a vazao
+    info = {}
+    inicio = time.perf_counter()
+    try:
+        yield info
+    finally:
+        registrar_etapa(nome, time.perf_counter() - inicio, info.get("registros"))
+
+def registrar_cache(nome, acerto, segundos):
+    _acumular(_caches, nome, {"acertos" if acerto else "falhas": 1, "segundos": segundos})
+    _log({"tipo": "cache", "nome": nome, "acerto": acerto, "segundos": round(segundos, 4)})
+
+def registrar_tamanho(nome, n_bytes):
+    with _lock:
+        atual = _tamanhos.setdefault(nome, {"max_bytes": 0})
+        atual["ultimo_bytes"] = n_bytes
+        atual["max_bytes"] = max(atual["max_bytes"], n_bytes)
+    _log({"tipo": "payload", "nome": nome, "bytes": n_bytes})
+
+def medir_cache(nome, decorador_cache):
+    # Envolve um decorador de cache (ex.: st.cache_data(...)). A funcao
+    # interna so roda quando o cache falha, entao a marca na thread diz se
+    # a chamada foi acerto ou falha. Chamadas aninhadas guardam a marca anterior.
+    def aplicar(func):
+        @functools.wraps(func)
+        def executar(*args, **kwargs):
+            _local.falhou = True
+            return func(*args, **kwargs)
+
+        em_cache = decorador_cache(executar)
+
+        @functools.wraps(func)
+        def chamar(*args, **kwargs):
+            anterior = getattr(_local, "falhou", False)
+            _local.falhou = False
+            inicio = time.perf_counter()
+            try:
+                return em_cache(*args, **kwargs)
+            finally:
+                registrar_cache(nome, not _local.falhou, time.perf_counter() - inicio)
+                _local.falhou = anterior
+
+        chamar.clear = em_cache.clear
+        return chamar
+    return aplicar
+
+# =====================================================
+# CONSULTA
+# =====================================================
+
+def resumo():
+    with _lock:
+        requisicoes = {k: dict(v) for k, v in _requisicoes.items()}
+        etapas = {k: dict(v) for k, v in _etapas.items()}
+        caches = {k: dict(v) for k, v in _caches.items()}
+        tamanhos = {k: dict(v) for k, v in _tamanhos.items()}
+        controle = dict(_controle)
+        eventos = list(_eventos)
+
+    for r in requisicoes.values():
+        n = r.get("requisicoes", 0)
+        r["media_ms"] = round(r.get("segundos", 0) / n * 1000, 1) if n else None
+        r["registros_por_s"] = round(r.get("registros", 0) / r["segundos"]) if r.get("segundos") else None
+    for e in etapas.values():
+        e["media_ms"] = round(e["segundos"] / e["execucoes"] * 1000, 1)
+        if e.get("registros") and e["segundos"]:
+            e["registros_por_s"] = round(e["registros"] / e["segundos"])
+    for c in caches.values():
+        total = c.get("acertos", 0) + c.get("falhas", 0)
+        c["taxa_acerto"] = round(c.get("acertos", 0) / total, 3) if total else None
+
+    return {
+        "gerado_em":   round(time.time(), 3),
+        "requisicoes": requisicoes,
+        "etapas":      etapas,
+        "caches":      caches,
+        "payloads":    tamanhos,
+        "controle":    controle,
+        "eventos":     eventos,
+    }
+
+def limpar():
+    with _lock:
+        for tabela in (_requisicoes, _etapas, _caches, _tamanhos, _controle, _eventos):
+            tabela.clear()
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metricas"):
+            self.send_error(404)
+            return
+        corpo = json.dumps(resumo(), ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+def iniciar_servidor(porta=None):
+    # Sobe uma vez por processo; sem porta configurada nao faz nada
+    porta = PORTA_HTTP if porta is None else porta
+    if not porta:
+        return None
+    with _lock:
+        if _servidor["http"] is not None:
+            return _servidor["http"]
+        try:
+            servidor = ThreadingHTTPServer((HOST_HTTP, porta), _Handler)
+        except OSError as e:
+            print("Erro iniciando servidor de metricas: " + str(e))
+            return None
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        _servidor["http"] = servidor
+        return servidor
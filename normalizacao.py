@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+COLS_PADRAO      = ["Codigo", "Nome", "Categoria", "UF", "Fonte", "Potencia MW", "Lat", "Lon"]
+COLS_FABRICANTE  = ["NomFabricanteModulo", "NomFabricanteInversor"]
+COLS_FINAIS      = COLS_PADRAO + COLS_FABRICANTE
+COLS_CATEGORICAS = ["UF", "Fonte", "Categoria"] + COLS_FABRICANTE
+COLS_FLOAT32     = ["Potencia MW", "Lat", "Lon"]
+
+CATEGORIA_USINA = "Usina (Geracao Centralizada)"
+CATEGORIA_GD    = "Geracao Distribuida"
+FASE_OPERACAO   = "Opera\u00e7\u00e3o"
+
+RENOMEAR_USINAS = {
+    "CodCEG":               "Codigo",
+    "NomEmpreendimento":    "Nome",
+    "SigUFPrincipal":       "UF",
+    "DscOrigemCombustivel": "Fonte",
+}
+RENOMEAR_GD = {
+    "CodEmpreendimento":        "Codigo",
+    "NomTitularEmpreendimento": "Nome",
+    "SigUF":                    "UF",
+    "DscFonteGeracao":          "Fonte",
+}
+POTENCIA_USINAS = "MdaPotenciaOutorgadaKw"
+POTENCIA_GD     = "MdaPotenciaInstaladaKW"
+COORD_LAT       = "NumCoordNEmpreendimento"
+COORD_LON       = "NumCoordEEmpreendimento"
+
+_NUMERO_VALIDO = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+
+# =====================================================
+# PARSE VETORIZADO
+# =====================================================
+
+def _texto_arrow(serie):
+    try:
+        return pa.array(serie, type=pa.string(), from_pandas=True)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        return pa.array(serie.astype(str), type=pa.string())
+
+def _para_float(arr):
+    # Valores que nao sao numeros viram NaN, como pd.to_numeric(errors="coerce").
+    # O cast do Arrow recusa espacos nas pontas, que o pandas aceitava.
+    arr = pc.utf8_trim_whitespace(arr)
+    validos = pc.match_substring_regex(arr, _NUMERO_VALIDO)
+    valores = pc.cast(pc.if_else(validos, arr, pa.scalar(None, pa.string())), pa.float64())
+    return valores.to_numpy(zero_copy_only=False)
+
+def parse_numero_br(serie):
+    # "1.234,5" -> 1234.5, com os kernels do Arrow em vez de copias de strings do pandas
+    if serie is None:
+        return None
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        return serie.to_numpy(dtype="float64", na_value=np.nan)
+    arr = pc.replace_substring(_texto_arrow(serie), ".", "")
+    return _para_float(pc.replace_substring(arr, ",", "."))
+
+def parse_coordenada(serie):
+    # "-23,55" -> -23.55
+    if serie is None:
+        return None
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        return serie.to_numpy(dtype="float64", na_value=np.nan)
+    return _para_float(pc.replace_substring(_texto_arrow(serie), ",", "."))
+
+def limpar_codigo(serie):
+    return pd.Series(pc.utf8_trim_whitespace(_texto_arrow(serie)).to_pandas(), index=serie.index)
+
+# =====================================================
+# NORMALIZACAO DAS BASES
+# =====================================================
+
+def detectar_tipo(colunas):
+    colunas = set(colunas)
+    if all(c in colunas for c in COLS_PADRAO):
+        return "processado"
+    if "CodCEG" in colunas:
+        return "usina"
+    if "CodEmpreendimento" in colunas:
+        return "gd"
+    return None
+
+def _float32(valores, n):
+    if valores is None:
+        return np.full(n, np.nan, dtype="float32")
+    return valores.astype("float32")
+
+def _montar(df, renomear, col_potencia, categoria):
+    n = len(df)
+    potencia = parse_numero_br(df.get(col_potencia))
+    saida = {}
+    for origem, destino in renomear.items():
+        saida[destino] = df[origem].to_numpy() if origem in df.columns else np.full(n, None, dtype=object)
+    saida["Categoria"]   = np.full(n, categoria, dtype=object)
+    saida["Potencia MW"] = _float32(None if potencia is None else potencia / 1000, n)
+    saida["Lat"]         = _float32(parse_coordenada(df.get(COORD_LAT)), n)
+    saida["Lon"]         = _float32(parse_coordenada(df.get(COORD_LON)), n)
+    # Arquivos brutos podem trazer as colunas de fabricante ja preenchidas
+    colunas = COLS_PADRAO + [c for c in COLS_FABRICANTE if c in df.columns]
+    for col in colunas[len(COLS_PADRAO):]:
+        saida[col] = df[col].to_numpy()
+    return pd.DataFrame(saida, columns=colunas)
+
+def normalizar_usinas(df):
+    if "DscFaseUsina" in df.columns:
+        df = df[df["DscFaseUsina"] == FASE_OPERACAO]
+    return _montar(df, RENOMEAR_USINAS, POTENCIA_USINAS, CATEGORIA_USINA)
+
+def normalizar_gd(df, df_tech=None):
+    saida = _montar(df, RENOMEAR_GD, POTENCIA_GD, CATEGORIA_GD)
+    if df_tech is not None and not df_tech.empty and "CodEmpreendimento" in df.columns:
+        cols_foto = [c for c in ["CodGeracaoDistribuida"] + COLS_FABRICANTE if c in df_tech.columns]
+        if "CodGeracaoDistribuida" in cols_foto and len(cols_foto) > 1:
+            saida["Codigo"] = limpar_codigo(df["CodEmpreendimento"]).to_numpy()
+            tech = df_tech[cols_foto].assign(
+                CodGeracaoDistribuida=limpar_codigo(df_tech["CodGeracaoDistribuida"])
+            )
+            saida = saida.drop(columns=COLS_FABRICANTE, errors="ignore").merge(
+                tech, left_on="Codigo", right_on="CodGeracaoDistribuida", how="left"
+            )
+    for col in COLS_FABRICANTE:
+        if col not in saida.columns:
+            saida[col] = "-"
+    return saida[COLS_FINAIS]
+
+def normalizar_arquivo(df):
+    # Detecta o tipo do CSV carregado: processado, bruto de usinas ou bruto de GD
+    tipo = detectar_tipo(df.columns)
+    if tipo == "processado":
+        return compactar(df.dropna(subset=["Lat", "Lon"]).reset_index(drop=True))
+
+    if tipo == "usina":
+        saida = normalizar_usinas(df)
+    elif tipo == "gd":
+        saida = normalizar_gd(df)
+    else:
+        saida = df
+
+    saida = saida.copy() if saida is df else saida
+    for col in COLS_FABRICANTE:
+        if col not in saida.columns:
+            saida[col] = "-"
+    cols_presentes = [c for c in COLS_FINAIS if c in saida.columns]
+    return compactar(saida[cols_presentes].dropna(subset=["Lat", "Lon"]).reset_index(drop=True))
+
+def unificar(partes):
+    partes = [p for p in partes if not p.empty]
+    if not partes:
+        return compactar(pd.DataFrame(columns=COLS_FINAIS))
+    df = concatenar_compacto(partes).reindex(columns=COLS_FINAIS)
+    return compactar(df.dropna(subset=["Lat", "Lon"]).reset_index(drop=True))
+
+# =====================================================
+# ESQUEMA COMPACTO
+# =====================================================
+
+def compactar(df):
+    # float32 para medidas e coordenadas, categorias para colunas repetitivas
+    for col in COLS_FLOAT32:
+        if col in df.columns and df[col].dtype != "float32":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+    for col in COLS_CATEGORICAS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+def concatenar_compacto(partes):
+    # pd.concat transforma categorias diferentes em object; alinhando as
+    # categorias antes, o resultado ja nasce compacto.
+    partes = [compactar(p) for p in partes]
+    for col in COLS_CATEGORICAS:
+        if all(col in p.columns for p in partes):
+            try:
+                categorias = pd.api.types.union_categoricals([p[col] for p in partes]).categories
+            except TypeError:
+                continue
+            for p in partes:
+                p[col] = p[col].cat.set_categories(categorias)
+    return pd.concat(partes, ignore_index=True)
+
+def bytes_por_linha(df):
+    if df.empty:
+        return 0.0
+    return float(df.memory_usage(deep=True).sum()) / len(df)
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CACHE_DIR    = os.environ.get("ANEEL_CACHE_DIR", ".cache_aneel")
+SNAPSHOT_TTL = float(os.environ.get("ANEEL_SNAPSHOT_TTL_HORAS", "24")) * 3600
+
+_lock = threading.Lock()
+_em_atualizacao = set()
+
+def _caminhos(chave, diretorio=None):
+    base = os.path.join(diretorio or CACHE_DIR, chave)
+    return base + ".parquet", base + ".manifest.json"
+
+def ler_manifesto(chave, diretorio=None):
+    _, caminho_manifesto = _caminhos(chave, diretorio)
+    try:
+        with open(caminho_manifesto, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def snapshot_expirado(manifesto, ttl=None):
+    ttl = SNAPSHOT_TTL if ttl is None else ttl
+    return time.time() - manifesto.get("gerado_em", 0) > ttl
+
+def ler_snapshot(chave, diretorio=None):
+    caminho_dados, _ = _caminhos(chave, diretorio)
+    manifesto = ler_manifesto(chave, diretorio)
+    if manifesto is None or not os.path.exists(caminho_dados):
+        return None, None
+    try:
+        tabela = pq.read_table(caminho_dados, memory_map=True)
+    except (OSError, pa.ArrowException) as e:
+        print("Snapshot invalido " + chave + ": " + str(e))
+        return None, None
+    df = tabela.to_pandas()
+    df.attrs["total"] = manifesto.get("total")
+    return df, manifesto
+
+def gravar_snapshot(chave, df, total=None, diretorio=None, extras=None):
+    caminho_dados, caminho_manifesto = _caminhos(chave, diretorio)
+    os.makedirs(os.path.dirname(caminho_dados), exist_ok=True)
+
+    if total is None:
+        total = df.attrs.get("total")
+
+    # Grava em arquivos temporarios e troca atomicamente, para que um leitor
+    # concorrente nunca veja um snapshot pela metade. O sufixo evita que dois
+    # processos (ou threads) gravando a mesma chave usem o mesmo temporario.
+    sufixo = "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(tabela, caminho_dados + sufixo)
+    os.replace(caminho_dados + sufixo, caminho_dados)
+
+    agora = time.time()
+    manifesto = {
+        "chave":     chave,
+        "gerado_em": agora,
+        "gerado_em_iso": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(agora)),
+        "registros": len(df),
+        "total":     total,
+        "colunas":   list(df.columns),
+    }
+    manifesto.update(extras or {})
+    with open(caminho_manifesto + sufixo, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(caminho_manifesto + sufixo, caminho_manifesto)
+    return manifesto
+
+def resultado_completo(df):
+    # Vazio so e resultado valido quando a API confirmou total = 0
+    return not df.empty or df.attrs.get("total") == 0
+
+def _atualizar(chave, carregar, diretorio, extras):
+    try:
+        df = carregar()
+        if resultado_completo(df):
+            gravar_snapshot(chave, df, diretorio=diretorio, extras=extras)
+    except Exception as e:
+        print("Erro atualizando snapshot " + chave + ": " + str(e))
+    finally:
+        with _lock:
+            _em_atualizacao.discard(chave)
+
+def atualizar_em_segundo_plano(chave, carregar, diretorio=None, extras=None):
+    with _lock:
+        if chave in _em_atualizacao:
+            return False
+        _em_atualizacao.add(chave)
+    threading.Thread(target=_atualizar, args=(chave, carregar, diretorio, extras), daemon=True).start()
+    return True
+
+def obter_snapshot(chave, carregar, ttl=None, diretorio=None):
+    # Snapshot fresco: leitura local. Snapshot vencido: serve o antigo e
+    # atualiza em segundo plano. Sem snapshot: baixa e grava agora.
+    df, manifesto = ler_snapshot(chave, diretorio)
+    if df is not None:
+        if snapshot_expirado(manifesto, ttl):
+            atualizar_em_segundo_plano(chave, carregar, diretorio)
+        return df
+
+    df = carregar()
+    if resultado_completo(df):
+        gravar_snapshot(chave, df, diretorio=diretorio)
+    return df
@@ -0,0 +1,65 @@
+import pytest
+import requests
+
+import cliente_aneel
+import snapshot
+from cliente_aneel import RES_USINAS, DownloadIncompleto, baixar_tabela
+
+
+class Resposta:
+    headers = {}
+
+    def __init__(self, status_code, dados):
+        self.status_code = status_code
+        self.dados = dados
+        self.content = b"{}"
+
+    def json(self):
+        return self.dados
+
+
+class SessaoFalsa:
+    # Recusa qualquer projecao com HTTP 409, como o CKAN faz com um campo
+    # inexistente; sem projecao devolve uma pagina unica
+    def __init__(self, erro=None):
+        self.erro = erro
+        self.pedidos = []
+
+    def get(self, url, params=None, timeout=None):
+        self.pedidos.append(dict(params))
+        if self.erro is not None:
+            raise self.erro
+        if "fields" in params:
+            return Resposta(409, {"success": False, "error": {"message": "campo invalido"}})
+        return Resposta(200, {"success": True, "result": {
+            "total": 2,
+            "fields": [{"id": "CodCEG", "type": "text"}, {"id": "NomEmpreendimento", "type": "text"}],
+            "records": [{"CodCEG": "UTE.1", "NomEmpreendimento": "A"}, {"CodCEG": "UHE.2", "NomEmpreendimento": "B"}],
+        }})
+
+
+@pytest.fixture(autouse=True)
+def sem_espera(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cliente_aneel.time, "sleep", lambda segundos: None)
+
+
+def test_projecao_recusada_baixa_todas_as_colunas(monkeypatch):
+    sessao = SessaoFalsa()
+    monkeypatch.setattr(cliente_aneel, "get_session", lambda: sessao)
+
+    tabela, total = baixar_tabela(RES_USINAS, fields=["CodCEG", "NaoExiste"])
+
+    assert total == 2 and tabela.num_rows == 2
+    assert "fields" in sessao.pedidos[0] and "fields" not in sessao.pedidos[-1]
+
+
+def test_api_fora_do_ar_nao_repete_sem_projecao(monkeypatch):
+    sessao = SessaoFalsa(erro=requests.ConnectionError("conexao recusada"))
+    monkeypatch.setattr(cliente_aneel, "get_session", lambda: sessao)
+
+    with pytest.raises(DownloadIncompleto):
+        baixar_tabela(RES_USINAS, fields=["CodCEG"])
+
+    assert len(sessao.pedidos) == cliente_aneel.MAX_TENTATIVAS
+    assert all("fields" in p for p in sessao.pedidos)
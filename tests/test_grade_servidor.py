@@ -0,0 +1,24 @@
+import pandas as pd
+
+from grade_servidor import GradeServidor
+from indice_filtros import IndiceFiltros
+from normalizacao import COLS_FINAIS, compactar, concatenar_compacto
+
+
+def _base(fontes):
+    df = pd.DataFrame({c: [None] * len(fontes) for c in COLS_FINAIS})
+    df["Fonte"] = fontes
+    df["Potencia MW"] = 1.0
+    return compactar(df)
+
+
+def test_ordem_categorica_alfabetica():
+    # Categorias unidas na ordem de chegada: Solar antes de Biogas
+    df = concatenar_compacto([_base(["Solar", "Nuclear"]), _base(["Biogas", "Hidraulica", None])])
+    grade = GradeServidor(df, IndiceFiltros(df))
+
+    ordem = grade.ordem_global("Fonte", True)
+    assert df["Fonte"].iloc[ordem].tolist()[:4] == ["Biogas", "Hidraulica", "Nuclear", "Solar"]
+    assert pd.isna(df["Fonte"].iloc[ordem[-1]])
+    ordem = grade.ordem_global("Fonte", False)
+    assert df["Fonte"].iloc[ordem].tolist()[:4] == ["Solar", "Nuclear", "Hidraulica", "Biogas"]
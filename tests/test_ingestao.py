@@ -0,0 +1,185 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+import ingestao
+import snapshot
+from cliente_aneel import DownloadIncompleto
+from dados_tecnicos import deduplicar, gravar_lookup
+from ingestao import RES_GD_INFO, RES_USINAS, chave_normalizado, chave_shard
+from normalizacao import COLS_FINAIS, FASE_OPERACAO
+from snapshot import gravar_snapshot, ler_manifesto
+
+TECNICOS = pd.DataFrame({
+    "CodGeracaoDistribuida": ["GD1", "GD2", "GD3", "GD4"],
+    "NomFabricanteModulo":   ["Modulo A", "Modulo B", "Modulo A", "Modulo C"],
+    "NomFabricanteInversor": ["Inversor A", "Inversor A", "Inversor B", "Inversor B"],
+})
+
+
+class LookupCompleto:
+    completo = True
+
+
+def _usinas(linhas):
+    return pd.DataFrame(linhas, columns=[
+        "CodCEG", "NomEmpreendimento", "SigUFPrincipal", "DscOrigemCombustivel",
+        "MdaPotenciaOutorgadaKw", "NumCoordNEmpreendimento", "NumCoordEEmpreendimento", "DscFaseUsina",
+    ]).rename_axis("_id").reset_index()
+
+
+def _gd(linhas):
+    return pd.DataFrame(linhas, columns=[
+        "CodEmpreendimento", "NomTitularEmpreendimento", "SigUF", "DscFonteGeracao",
+        "MdaPotenciaInstaladaKW", "NumCoordNEmpreendimento", "NumCoordEEmpreendimento",
+    ]).rename_axis("_id").reset_index()
+
+
+def _gravar(usinas, gd, uf="RJ"):
+    gravar_snapshot(chave_shard(RES_USINAS, uf), usinas)
+    gravar_snapshot(chave_shard(RES_GD_INFO, uf), gd)
+
+
+def _ordenado(df):
+    df = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return df[COLS_FINAIS].sort_values(["Categoria", "Codigo"]).reset_index(drop=True)
+
+
+@pytest.fixture(autouse=True)
+def cache_temporario(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "CACHE_DIR", str(tmp_path))
+
+
+@pytest.fixture
+def lookup_falso(monkeypatch):
+    monkeypatch.setattr(ingestao, "carregar_lookup", LookupCompleto)
+    monkeypatch.setattr(ingestao, "tecnicos_da_selecao", lambda df_gd: TECNICOS)
+
+
+@pytest.mark.usefixtures("lookup_falso")
+def test_incremental_igual_a_normalizacao_completa():
+    op = FASE_OPERACAO
+    _gravar(
+        _usinas([
+            ["UTE.1", "Usina 1", "RJ", "G\u00e1s", "1.500,0", "-22,9", "-43,2", op],
+            ["UHE.2", "Usina 2", "RJ", "H\u00eddrica", "30.000", "-22,5", "-44,1", op],
+            ["UFV.3", "Usina 3", "RJ", "Solar", "5.000", "-22,1", "-42,0", "Constru\u00e7\u00e3o"],
+        ]),
+        _gd([
+            ["GD1", "Titular 1", "RJ", "Solar", "7,5", "-22,90", "-43,10"],
+            ["GD2", "Titular 2", "RJ", "Solar", "10", "-22,80", "-43,00"],
+            ["GD3", "Titular 3", "RJ", "E\u00f3lica", "75", "-22,70", "-42,90"],
+        ]),
+    )
+    ingestao.renormalizar_uf("RJ")
+    assert ler_manifesto(chave_normalizado("RJ"))["incremental"] is False
+
+    # Potencia alterada, fase alterada, fonte alterada, uma remocao, duas
+    # inclusoes e os _id todos renumerados (o _id nao entra no hash)
+    usinas = _usinas([
+        ["UFV.3", "Usina 3", "RJ", "Solar", "5.000", "-22,1", "-42,0", op],
+        ["UTE.1", "Usina 1", "RJ", "G\u00e1s", "1.800,0", "-22,9", "-43,2", op],
+        ["UHE.2", "Usina 2", "RJ", "H\u00eddrica", "30.000", "-22,5", "-44,1", op],
+        ["UTE.4", "Usina 4", "RJ", "Biomassa", "900", "-21,9", "-41,3", op],
+    ])
+    gd = _gd([
+        ["GD4", "Titular 4", "RJ", "Solar", "4,2", "-22,60", "-43,30"],
+        ["GD2", "Titular 2", "RJ", "Solar", "10", "-22,80", "-43,00"],
+        ["GD1", "Titular 1", "RJ", "H\u00eddrica", "7,5", "-22,90", "-43,10"],
+    ])
+    _gravar(usinas, gd)
+    incremental = ingestao.renormalizar_uf("RJ")
+    assert ler_manifesto(chave_normalizado("RJ"))["incremental"] is True
+
+    completa = ingestao.unificar([
+        ingestao.normalizar_recurso(RES_USINAS, usinas), ingestao.normalizar_recurso(RES_GD_INFO, gd),
+    ])
+    # Mesmas linhas; a ordem muda porque as linhas refeitas vao para o fim
+    pd.testing.assert_frame_equal(_ordenado(incremental), _ordenado(completa))
+
+    feed, contagem = ingestao.mudancas(["RJ"])
+    assert contagem == {"adicionado": 2, "alterado": 3, "removido": 1}
+    assert sorted(feed.loc[feed["Mudanca"] == "removido", "Codigo"].astype(str)) == ["GD3"]
+    assert sorted(feed.loc[feed["Mudanca"] == "adicionado", "Codigo"].astype(str)) == ["GD4", "UTE.4"]
+
+
+@pytest.mark.usefixtures("lookup_falso")
+def test_sem_mudancas_mantem_a_base():
+    usinas = _usinas([["UTE.1", "Usina 1", "RJ", "G\u00e1s", "1.500,0", "-22,9", "-43,2", FASE_OPERACAO]])
+    gd = _gd([["GD1", "Titular 1", "RJ", "Solar", "7,5", "-22,90", "-43,10"]])
+    _gravar(usinas, gd)
+    antes = ingestao.renormalizar_uf("RJ")
+    _gravar(usinas, gd)
+    depois = ingestao.renormalizar_uf("RJ")
+
+    pd.testing.assert_frame_equal(_ordenado(depois), _ordenado(antes))
+    feed, contagem = ingestao.mudancas(["RJ"])
+    assert feed.empty and contagem == {"adicionado": 0, "alterado": 0, "removido": 0}
+
+
+@pytest.mark.usefixtures("lookup_falso")
+def test_shard_que_falhou_nao_e_baixado_de_novo(monkeypatch):
+    chamadas = []
+
+    def baixar(res, uf):
+        chamadas.append((res, uf))
+        if res == RES_GD_INFO:
+            raise DownloadIncompleto("GD Info " + uf, 10, 20)
+        return _usinas([["UTE.1", "Usina 1", uf, "G\u00e1s", "1.500,0", "-22,9", "-43,2", FASE_OPERACAO]])
+
+    monkeypatch.setattr(ingestao, "baixar_shard", baixar)
+    with pytest.raises(DownloadIncompleto):
+        ingestao.carregar_dados_unificados(("RJ",), processos=1)
+    assert sorted(chamadas) == sorted([(RES_USINAS, "RJ"), (RES_GD_INFO, "RJ")])
+
+
+@pytest.mark.usefixtures("lookup_falso")
+def test_ingerir_nao_normaliza_uf_sem_shard(monkeypatch):
+    chamadas = []
+
+    def baixar(res, uf):
+        chamadas.append((res, uf))
+        if res == RES_GD_INFO and uf == "RJ":
+            raise DownloadIncompleto("GD Info RJ", 10, 20)
+        if res == RES_GD_INFO:
+            return _gd([["GD1", "Titular 1", uf, "Solar", "7,5", "-22,90", "-43,10"]])
+        return _usinas([["UTE.1", "Usina 1", uf, "G\u00e1s", "1.500,0", "-22,9", "-43,2", FASE_OPERACAO]])
+
+    monkeypatch.setattr(ingestao, "baixar_shard", baixar)
+    falhas = ingestao.ingerir(["MG", "RJ"], ["usinas", "gd_info"], processos=1)
+
+    assert sorted(falhas) == sorted([chave_shard(RES_GD_INFO, "RJ"), chave_normalizado("RJ")])
+    assert len(chamadas) == 4
+    assert ler_manifesto(chave_normalizado("MG")) is not None
+    assert ler_manifesto(chave_normalizado("RJ")) is None
+
+
+def test_processos_igual_ao_caminho_serial(tmp_path):
+    # Os processos (spawn) nao veem monkeypatch: o lookup completo fica em
+    # disco, como depois de "python -m ingestao --recursos gd_foto"
+    gravar_lookup(deduplicar(TECNICOS), True)
+    op = FASE_OPERACAO
+    for uf, n in (("SP", 0), ("RJ", 2)):
+        _gravar(
+            _usinas([
+                ["UTE." + uf, "Usina " + uf, uf, "G\u00e1s", "1.500,0", "-22,9", "-43,2", op],
+                ["UFV." + uf, "Usina 2 " + uf, uf, "Solar", "5.000", "-22,1", "-42,0", "Constru\u00e7\u00e3o"],
+            ]),
+            _gd([
+                ["GD" + str(n + 1), "Titular 1", uf, "Solar", "7,5", "-22,90", "-43,10"],
+                ["GD" + str(n + 2), "Titular 2", uf, "E\u00f3lica", "75", "-22,70", "-42,90"],
+                ["GD9", "Sem tecnicos", uf, "Solar", "3", "-22,60", "-43,00"],
+            ]),
+            uf,
+        )
+
+    paralelo = ingestao.normalizar_ufs(["SP", "RJ"], 2, min_registros=0)
+    assert sorted(paralelo) == ["RJ", "SP"]
+
+    for prefixo in ("normalizado_", "hashes_", "mudancas_"):
+        for caminho in glob.glob(os.path.join(str(tmp_path), prefixo + "*")):
+            os.remove(caminho)
+    for uf in ("SP", "RJ"):
+        pd.testing.assert_frame_equal(paralelo[uf], ingestao.renormalizar_uf(uf))
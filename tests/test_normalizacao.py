@@ -0,0 +1,14 @@
+import numpy as np
+import pandas as pd
+
+from normalizacao import parse_coordenada, parse_numero_br
+
+
+def test_parse_numero_br_com_espacos():
+    serie = pd.Series(["7,25 ", " 1.234,5", "\t3\n", "abc", None, ""])
+    np.testing.assert_allclose(parse_numero_br(serie), [7.25, 1234.5, 3.0, np.nan, np.nan, np.nan])
+
+
+def test_parse_coordenada_com_espacos():
+    serie = pd.Series([" -23,55 ", "-46,6", " x "])
+    np.testing.assert_allclose(parse_coordenada(serie), [-23.55, -46.6, np.nan])